@@ -6,8 +6,8 @@ Outputs 53-TET Text files to dataset/text_files/53_tet_files
 """
 
 import os
+import re
 import sys
-import ast
 import traceback
 import argparse
 import mido
@@ -34,6 +34,18 @@ except ImportError:
 # CONSTANTS & CONFIGURATION
 # ==========================================
 
+# Text files hold a flat list repr of string tokens, e.g. ['.', '1.0', 'C', 'maj7']
+TOKEN_RE = re.compile(r"'([^']*)'")
+
+# Key and tonality suffix of a file stem, e.g. 'Autumn_Leaves_Bb_minor'
+KEY_RE = re.compile(r'_([a-zA-Z#]+)_(major|minor)$', re.IGNORECASE)
+
+# 12-TET pitch class of a note letter, indexed by ord(letter); -1 for anything else
+NOTE_BASE = bytes([0, 2, 4, 5, 7, 9, 11])
+NOTE_PC = [-1] * 128
+for _ch, _pc in zip('CDEFGAB', NOTE_BASE):
+    NOTE_PC[ord(_ch)] = _pc
+
 # 53-TET Note Definitions (0-52)
 NOTE_NAMES_53TET = [
     "C", "^C", "^^C", "vvC#", "vC#", "C#", "^C#", "^^C#", "vD", "D", 
@@ -150,6 +162,38 @@ def get_new_chord_name(intervals_in_steps):
         return convention.get_name(q3, q5, q7)
     return str(intervals_in_steps)
 
+def note_pitch_class(token):
+    """Pitch class (0-11) of a root/bass token such as 'C', 'F#' or 'Bb', or -1 if it is not a note."""
+    n = len(token)
+    if n == 0 or n > 2:
+        return -1
+    c = ord(token[0])
+    pc = NOTE_PC[c] if c < 128 else -1
+    if pc < 0 or n == 1:
+        return pc
+    acc = token[1]
+    # Only the spellings used by the chord text files (no E#, B#, Cb, Fb)
+    if acc == '#' and pc != 4 and pc != 11:
+        return pc + 1
+    if acc == 'b' and pc != 0 and pc != 5:
+        return pc - 1
+    return -1
+
+def detect_key_from_stem(stem):
+    """Return (key, is_minor) from a 'Name_Key_Tonality' file stem, defaulting to C major."""
+    # Case insensitive match for key in filename (e.g. Name_Key_Tonality)
+    match = KEY_RE.search(stem)
+    if not match:
+        # print(f"⚠️  Could not detect key from filename, defaulting to C")
+        return 'C', False
+    key = match.group(1)
+    # Normalize key case just in case (e.g. 'bb' -> 'Bb')
+    if len(key) > 1:
+        key = key[0].upper() + key[1].lower()
+    else:
+        key = key.upper()
+    return key, match.group(2).lower() == 'minor'
+
 def get_53tet_ratio(steps):
     return 2 ** (steps / 53.0)
 
@@ -225,71 +269,69 @@ def process_text_file_conversion(input_path, scale_type, key, chromatic_scale, o
     """
     Finds the corresponding text file for a MIDI file and converts its chords to 53-TET notation.
     """
-    # Locate text directory
+    # Locate text directory (plain str paths: this probe runs once per file)
+    stem = input_path.stem
+    grandparent = os.fspath(input_path.parent.parent)
+    great_grandparent = os.path.dirname(grandparent)
     potential_text_dirs = [
-        input_path.parent.parent.parent / "text_files" / "12_tet_files",
-        input_path.parent.parent.parent / "text_files", 
-        input_path.parent.parent / "text_files",        
-        Path("dataset/text_files/12_tet_files").resolve(),
-        Path("dataset/text_files").resolve(),
-        Path("../dataset/text_files/12_tet_files").resolve(),
-        Path("../dataset/text_files").resolve()
+        os.path.join(great_grandparent, "text_files", "12_tet_files"),
+        os.path.join(great_grandparent, "text_files"),
+        os.path.join(grandparent, "text_files"),
+        os.path.abspath("dataset/text_files/12_tet_files"),
+        os.path.abspath("dataset/text_files"),
+        os.path.abspath("../dataset/text_files/12_tet_files"),
+        os.path.abspath("../dataset/text_files")
     ]
     
     text_dir = None
     for d in potential_text_dirs:
-        if d.exists():
-            # Check if file actually exists in this dir to avoid false positives with empty dirs
-            if (d / (input_path.stem + ".txt")).exists():
-                text_dir = d
-                break
+        # Check if file actually exists in this dir to avoid false positives with empty dirs
+        if os.path.isfile(os.path.join(d, stem + ".txt")):
+            text_dir = d
+            break
     
     # If not found by specific file check, fall back to first existing dir (legacy behavior)
     if text_dir is None:
         for d in potential_text_dirs:
-            if d.exists():
+            if os.path.isdir(d):
                 text_dir = d
                 break
             
     if text_dir is None:
         # Fallback to checking typical location relative to script
-        script_dataset_text = Path(__file__).parent.parent / "dataset" / "text_files"
-        if script_dataset_text.exists():
+        script_dataset_text = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dataset", "text_files")
+        if os.path.isdir(script_dataset_text):
              text_dir = script_dataset_text
 
     if text_dir is None:
         print(f"⚠️ Could not locate text_files directory for {input_path.name}")
         return
 
-    text_filename = input_path.stem + ".txt"
-    text_path = text_dir / text_filename
+    text_path = os.path.join(text_dir, stem + ".txt")
     
-    if not text_path.exists():
+    if not os.path.isfile(text_path):
         # Try finding without some suffices if needed
-        text_filename_alt = input_path.stem.split("_type")[0] + ".txt" 
-        text_path_alt = text_dir / text_filename_alt
-        if text_path_alt.exists():
+        text_path_alt = os.path.join(text_dir, stem.split("_type")[0] + ".txt")
+        if os.path.isfile(text_path_alt):
              text_path = text_path_alt
         else:
             # print(f"ℹ️ Corresponding text file not found: {text_path}")
             return
+    text_path = Path(text_path)
         
     try:
         with open(text_path, 'r') as f:
             content = f.read()
-            try:
-                chord_data = ast.literal_eval(content)
-            except:
-                print(f"Could not parse text file as list structure: {text_path.name}")
-                return
+        chord_data = TOKEN_RE.findall(content)
+        if not chord_data:
+            print(f"Could not parse text file as list structure: {text_path.name}")
+            return
             
         modified_chords = []
         
-        chromatic_map = {
-            'C': 0, 'C#': 1, 'Db': 1, 'D': 2, 'D#': 3, 'Eb': 3,
-            'E': 4, 'F': 5, 'F#': 6, 'Gb': 6, 'G': 7, 'G#': 8,
-            'Ab': 8, 'A': 9, 'A#': 10, 'Bb': 10, 'B': 11
-        }
+        # interval_steps[root_idx_12][interval_12] -> 53-TET steps above the root
+        cs = np.asarray(chromatic_scale)
+        interval_steps = ((cs[(np.arange(12)[:, None] + np.arange(12)[None, :]) % 12] - cs[:, None]) % 53).tolist()
         
         i = 0
         while i < len(chord_data):
@@ -301,8 +343,8 @@ def process_text_file_conversion(input_path, scale_type, key, chromatic_scale, o
                 i += 1
                 if i < len(chord_data):
                     bass_token = chord_data[i]
-                    if bass_token in chromatic_map:
-                         bass_idx = chromatic_map[bass_token]
+                    bass_idx = note_pitch_class(bass_token)
+                    if bass_idx >= 0:
                          bass_step = chromatic_scale[bass_idx]
                          new_bass_name = NOTE_NAMES_53TET[bass_step]
                          modified_chords.append(new_bass_name)
@@ -312,14 +354,9 @@ def process_text_file_conversion(input_path, scale_type, key, chromatic_scale, o
                 continue
 
             # Check for Root match
-            is_root = False
-            root_text = ""
-            
-            if token in chromatic_map:
-                is_root = True
-                root_text = token
+            root_idx_12 = note_pitch_class(token)
             
-            if not is_root:
+            if root_idx_12 < 0:
                 modified_chords.append(token)
                 i += 1
                 continue
@@ -368,22 +405,15 @@ def process_text_file_conversion(input_path, scale_type, key, chromatic_scale, o
                 if '7' in q: input_intervals['seventh'] = 10
                 
             # Calculate 53-TET steps
-            root_idx_12 = chromatic_map[root_text]
             root_step = chromatic_scale[root_idx_12]
             
-            def get_step_from_12tet_interval(root_step, interval_12):
-                target_idx_12 = (root_idx_12 + interval_12) % 12
-                target_step = chromatic_scale[target_idx_12]
-                diff = target_step - root_step
-                if diff < 0: diff += 53
-                return diff
-
+            root_steps = interval_steps[root_idx_12]
             steps_map = {}
-            steps_map['third'] = get_step_from_12tet_interval(root_step, input_intervals['third'])
-            steps_map['fifth'] = get_step_from_12tet_interval(root_step, input_intervals['fifth'])
+            steps_map['third'] = root_steps[input_intervals['third']]
+            steps_map['fifth'] = root_steps[input_intervals['fifth']]
             
             if input_intervals['seventh'] is not None:
-                steps_map['seventh'] = get_step_from_12tet_interval(root_step, input_intervals['seventh'])
+                steps_map['seventh'] = root_steps[input_intervals['seventh']]
             else:
                 steps_map['seventh'] = None
                 
@@ -404,42 +434,27 @@ def process_text_file_conversion(input_path, scale_type, key, chromatic_scale, o
         else:
              output_path_dir = output_dir
 
-        output_text_filename = f"{input_path.stem}_{scale_type}.txt"
-        output_text_path = output_path_dir / output_text_filename
+        output_text_path = os.path.join(output_path_dir, f"{stem}_{scale_type}.txt")
         
-        with open(output_text_path, 'w') as f:
-            f.write(str(modified_chords))
+        # Same bytes as str(modified_chords), written in a single call
+        payload = b"[" + b", ".join(repr(t).encode() for t in modified_chords) + b"]"
+        with open(output_text_path, 'wb') as f:
+            f.write(payload)
             
     except Exception as e:
         print(f"❌ Error processing text file {text_path.name}: {e}")
         # traceback.print_exc()
 
-def convert_midi_to_53tet(input_midi_path, scale_type='type_1', output_dir=None, text_output_dir=None, key=None):
+def convert_midi_to_53tet(input_midi_path, scale_type='type_1', output_dir=None, text_output_dir=None, key=None, is_minor=None):
     
     input_path = Path(input_midi_path)
     if scale_type not in MODAL_SCALE_TYPES:
         raise ValueError(f"Unknown scale type: {scale_type}")
     
     if key is None:
-        import re
-        # Case insensitive match for key in filename (e.g. Name_Key_Tonality)
-        match = re.search(r'_([a-zA-Z#]+)_(major|minor)$', input_path.stem, re.IGNORECASE)
-        if match:
-            key = match.group(1)
-            tonality_str = match.group(2).lower()
-            # Normalize key case just in case (e.g. 'bb' -> 'Bb')
-            if len(key) > 1:
-                key = key[0].upper() + key[1].lower()
-            else:
-                key = key.upper()
-        else:
-            key = 'C'
-            tonality_str = 'major'
-            # print(f"⚠️  Could not detect key from filename, defaulting to C")
-    else:
-        tonality_str = 'major' # Default if key manually provided without tonality context
-
-    is_minor = 'minor' in tonality_str
+        key, is_minor = detect_key_from_stem(input_path.stem)
+    elif is_minor is None:
+        is_minor = False # Default if key manually provided without tonality context
     
     key_to_position = {
         'C': 0, 'C#': 1, 'Db': 1, 'D': 2, 'D#': 3, 'Eb': 3,
@@ -531,9 +546,10 @@ def process_single_file(args):
     """
     Wrapper for parallel execution
     """
-    midi_path, output_midi_dir, output_text_dir, scale_type = args
+    midi_path, output_midi_dir, output_text_dir, scale_type, key, is_minor = args
     try:
-        convert_midi_to_53tet(midi_path, scale_type=scale_type, output_dir=output_midi_dir, text_output_dir=output_text_dir)
+        convert_midi_to_53tet(midi_path, scale_type=scale_type, output_dir=output_midi_dir, text_output_dir=output_text_dir,
+                              key=key, is_minor=is_minor)
         return True, midi_path
     except Exception as e:
         # traceback.print_exc()
@@ -607,8 +623,10 @@ def main():
     # Prepare Tasks
     tasks = []
     for m in midi_files:
+        # Key depends only on the filename, so detect it once for all scale types
+        key, is_minor = detect_key_from_stem(m.stem)
         for scale_type in TARGET_SCALE_TYPES:
-            tasks.append((m, OUTPUT_MIDI_DIR, OUTPUT_TEXT_DIR, scale_type))
+            tasks.append((m, OUTPUT_MIDI_DIR, OUTPUT_TEXT_DIR, scale_type, key, is_minor))
     
     # Execute Parallel
     print("\nStarting parallel processing...")
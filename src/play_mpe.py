@@ -3,11 +3,85 @@ import subprocess
 import sys
 import os
 import tempfile
+import wave
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from scipy.io import wavfile
+from scipy.signal import oaconvolve
 import mido
 from pathlib import Path
 
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+# Oscillator ids, also the row of WAVETABLES (unknown names fall back to sine)
+WAVEFORM_IDS = {'sine': 0, 'triangle': 1, 'square': 2, 'clarinet': 3}
+
+# One period of each waveform, built once so synthesis never calls sin per sample.
+# The extra guard sample (== first sample) lets linear interpolation read idx + 1 without wrapping.
+WAVETABLE_SIZE = 4096
+
+# Odd-harmonic amplitudes per waveform row (harmonics 1, 3, ..., 13).
+# Triangle and square are kept as truncated Fourier series rather than exact shapes
+# (scipy.signal.square/sawtooth): the sum is band-limited, so high notes don't alias,
+# and since it is only evaluated once per table it costs nothing at render time.
+HARMONICS = np.arange(1, 15, 2)
+HARMONIC_COEFFS = np.zeros((len(WAVEFORM_IDS), len(HARMONICS)))
+# Pure sine wave
+HARMONIC_COEFFS[WAVEFORM_IDS['sine'], 0] = 1.0
+# Triangle wave (Fourier series approximation)
+HARMONIC_COEFFS[WAVEFORM_IDS['triangle']] = (8 / np.pi ** 2) * (-1.0) ** ((HARMONICS - 1) // 2) / HARMONICS ** 2
+# Square wave (Fourier series approximation)
+HARMONIC_COEFFS[WAVEFORM_IDS['square']] = (4 / np.pi) / HARMONICS
+# Clarinet-like (odd harmonics with specific weights)
+HARMONIC_COEFFS[WAVEFORM_IDS['clarinet'], :3] = [1.0, -0.11, 0.04]
+
+def _build_wavetables(size):
+    p = 2 * np.pi * np.arange(size + 1) / size
+    # Every table is a weighted sum of the same harmonic sines: one sin pass, one matmul
+    return (HARMONIC_COEFFS @ np.sin(np.outer(HARMONICS, p))).astype(np.float32)
+
+WAVETABLES = _build_wavetables(WAVETABLE_SIZE)
+
+# Envelope level (-60 dB) below which a decaying note is no longer synthesized
+ENV_FLOOR = 1e-3
+
+# Reverb taps. Left channel delays (prime numbers for natural sound)
+LEFT_DELAYS_MS = np.array([
+    # Early reflections (0-100ms)
+    23, 37, 53, 71, 89,
+    # Mid reflections (100-500ms)
+    113, 157, 211, 271, 337, 419, 487,
+    # Late reflections / decay tail (500ms-2000ms)
+    571, 677, 809, 977, 1123, 1289, 1451, 1613, 1787, 1949
+])
+
+# Right channel delays (offset from left for stereo width)
+RIGHT_DELAYS_MS = np.array([
+    29, 43, 61, 79, 97,
+    127, 173, 227, 293, 359, 433, 503,
+    607, 719, 857, 1009, 1163, 1319, 1483, 1657, 1823, 1987
+])
+
+# Exponential decay of each tap over 2 seconds, evaluated for all taps at once
+LEFT_DECAYS = np.exp(-3.5 * LEFT_DELAYS_MS / 2000.0)
+RIGHT_DECAYS = np.exp(-3.5 * RIGHT_DELAYS_MS / 2000.0)
+
+def _tap_impulse_response(delay_samples, decays, max_len):
+    """Impulse response with one decayed impulse per delay tap that falls inside max_len samples, normalized to unit tap sum."""
+    keep = delay_samples < max_len
+    ir = np.zeros(int(delay_samples[keep].max(initial=0)) + 1, dtype=np.float32)
+    ir[delay_samples[keep]] = decays[keep]
+    # Scale the taps to sum to 1 so the wet peak can never exceed the dry peak.
+    # This replaces measuring and matching both peaks after the convolution.
+    total = ir.sum()
+    if total > 0:
+        ir /= total
+    return ir
+
 def apply_reverb(audio, sample_rate, reverb_amount=0):
     """
     Apply stereo algorithmic reverb to audio signal with large room sound.
@@ -17,86 +91,444 @@ def apply_reverb(audio, sample_rate, reverb_amount=0):
         sample_rate: Sample rate in Hz
         reverb_amount: Reverb mix percentage (0-100), 0=dry, 100=fully wet
     
-    Returns: Stereo audio with reverb applied (2D array: samples x 2 channels)
+    Returns: Stereo audio with reverb applied (2D array: 2 channels x samples)
     """
     if reverb_amount <= 0:
-        # Return stereo with no reverb
-        stereo = np.column_stack([audio, audio])
-        return stereo
+        # Return stereo with no reverb (read-only view, no copy)
+        return np.broadcast_to(audio, (2, len(audio)))
     
     # Clamp reverb amount to 0-100
-    reverb_amount = np.clip(reverb_amount, 0, 100)
-    mix = reverb_amount / 100.0
+    reverb_amount = min(max(reverb_amount, 0), 100)
+    # Plain Python float so mixing keeps the float32 audio in float32
+    mix = float(reverb_amount) / 100.0
     
     # Create stereo reverb with different delays for left and right channels
-    left_reverb = np.zeros_like(audio)
-    right_reverb = np.zeros_like(audio)
-    
-    # Left channel delays (prime numbers for natural sound)
-    left_delays_ms = [
-        # Early reflections (0-100ms)
-        23, 37, 53, 71, 89,
-        # Mid reflections (100-500ms)
-        113, 157, 211, 271, 337, 419, 487,
-        # Late reflections / decay tail (500ms-2000ms)
-        571, 677, 809, 977, 1123, 1289, 1451, 1613, 1787, 1949
-    ]
-    
-    # Right channel delays (offset from left for stereo width)
-    right_delays_ms = [
-        29, 43, 61, 79, 97,
-        127, 173, 227, 293, 359, 433, 503,
-        607, 719, 857, 1009, 1163, 1319, 1483, 1657, 1823, 1987
-    ]
-    
-    # Apply left channel reverb with smooth 2-second decay
-    for i, delay_ms in enumerate(left_delays_ms):
-        delay_samples = int(delay_ms * sample_rate / 1000.0)
-        if delay_samples < len(audio):
-            # Exponential decay over 2 seconds
-            decay_position = delay_ms / 2000.0  # Position in 2-second decay
-            decay = np.exp(-3.5 * decay_position)  # Exponential decay
-            
-            delayed = np.zeros_like(audio)
-            delayed[delay_samples:] = audio[:-delay_samples] * decay
-            left_reverb += delayed
+    # Tap positions in samples (the decays are precomputed at import)
+    n = len(audio)
+    left_samples = (LEFT_DELAYS_MS * sample_rate / 1000.0).astype(np.int64)
+    right_samples = (RIGHT_DELAYS_MS * sample_rate / 1000.0).astype(np.int64)
     
-    # Apply right channel reverb with smooth 2-second decay
-    for i, delay_ms in enumerate(right_delays_ms):
-        delay_samples = int(delay_ms * sample_rate / 1000.0)
-        if delay_samples < len(audio):
-            # Exponential decay over 2 seconds
-            decay_position = delay_ms / 2000.0
-            decay = np.exp(-3.5 * decay_position)
-            
-            delayed = np.zeros_like(audio)
-            delayed[delay_samples:] = audio[:-delay_samples] * decay
-            right_reverb += delayed
-    
-    # Normalize reverb channels to match dry signal's peak level
-    # This ensures the mix percentage reflects the actual perceived amount
-    dry_peak = np.max(np.abs(audio))
-    if dry_peak > 0:
-        left_peak = np.max(np.abs(left_reverb))
-        if left_peak > 0:
-            left_reverb = left_reverb * (dry_peak / left_peak)
-        
-        right_peak = np.max(np.abs(right_reverb))
-        if right_peak > 0:
-            right_reverb = right_reverb * (dry_peak / right_peak)
+    # The taps form a sparse impulse response; convolve once per channel (FFT overlap-add)
+    left_reverb = oaconvolve(audio, _tap_impulse_response(left_samples, LEFT_DECAYS, n))[:n]
+    right_reverb = oaconvolve(audio, _tap_impulse_response(right_samples, RIGHT_DECAYS, n))[:n]
     
     # Mix dry and wet for each channel
     dry_level = 1.0 - mix
     wet_level = mix
     
-    left_channel = audio * dry_level + left_reverb * wet_level
-    right_channel = audio * dry_level + right_reverb * wet_level
-    
-    # Stack into stereo array
-    stereo = np.column_stack([left_channel, right_channel])
+    # Written straight into the stereo array (channels, samples); the dry part is shared
+    stereo = np.empty((2, n), dtype=audio.dtype)
+    np.multiply(audio, dry_level, out=stereo[0])
+    stereo[1] = stereo[0]
+    left_reverb *= wet_level
+    right_reverb *= wet_level
+    stereo[0] += left_reverb
+    stereo[1] += right_reverb
     
     return stereo
 
+def _render_notes_numpy(note_events, audio, offset, sample_rate, att_len, dec_len, rel_len, sustain_level, waveform):
+    """
+    Mix every note (ADSR envelope x oscillator) into audio in place. NumPy fallback when Numba is missing.
+    audio holds the output starting at sample offset.
+    """
+    num_samples = len(audio)
+    table = WAVETABLES[WAVEFORM_IDS.get(waveform, 0)]
+
+    # ADSR segments are the same for every note: build the master attack + decay envelope
+    # and the release ramp once, and slice them per note
+    master_env = np.concatenate([
+        np.linspace(0.0, 1.0, att_len, endpoint=False, dtype=np.float32),
+        np.linspace(1.0, sustain_level, dec_len, endpoint=False, dtype=np.float32),
+    ])
+    release_ramp = np.linspace(1.0, 0.0, rel_len, endpoint=False, dtype=np.float32)
+
+    # Notes with the same gate length share one envelope, so synthesize them together
+    groups = defaultdict(list)
+    for start, dur, freq, vel in note_events:
+        groups[int(dur * sample_rate)].append((int(start * sample_rate), freq, vel))
+
+    # One envelope buffer reused by every group, sized for the longest
+    scratch_env = np.empty(max(groups) + rel_len, dtype=np.float32)
+
+    for gate_len, notes in groups.items():
+        if gate_len >= att_len:
+            # 1.-2. Attack and (part of) the decay, straight from the master envelope
+            cursor = min(gate_len, att_len + dec_len)
+            scratch_env[:cursor] = master_env[:cursor]
+            if cursor == att_len + dec_len:
+                current_val = sustain_level
+            elif cursor > att_len:
+                current_val = master_env[cursor - 1]
+            else:
+                current_val = 1.0
+        else:
+            # Gate shorter than the attack (rare): the ramp is squeezed into the gate
+            cursor = gate_len
+            scratch_env[:cursor] = np.linspace(0.0, 1.0, gate_len, endpoint=False)
+            current_val = float(gate_len) / att_len
+
+        # 3. Sustain Phase
+        scratch_env[cursor:gate_len] = current_val
+
+        # 4. Release Phase: from a zero level it is silent, so the note ends with its gate
+        if current_val == 0:
+            total_note_len = gate_len
+        else:
+            total_note_len = gate_len + rel_len
+            np.multiply(release_ramp, current_val, out=scratch_env[gate_len:total_note_len])
+
+        # Past the attack the envelope only falls: drop the tail below the audible floor
+        attack_end = min(att_len, gate_len)
+        total_note_len = attack_end + int(np.searchsorted(-scratch_env[attack_end:total_note_len], -ENV_FLOOR, side='right'))
+        if total_note_len == 0:
+            continue
+        env = scratch_env[:total_note_len]
+
+        starts = np.array([n[0] for n in notes]) - offset
+        freqs = np.array([n[1] for n in notes])
+        gains = (np.array([n[2] for n in notes]) * 0.15).astype(np.float32)
+        t = np.arange(total_note_len)
+
+        # Rows per 2D block, bounded so a block stays around 4M samples
+        rows = max(1, (1 << 22) // total_note_len)
+        for b in range(0, len(notes), rows):
+            # Read the oscillators from the wavetable: phase advances freq * size / sample_rate per sample.
+            # The phase itself needs float64 (it grows to ~1e8); everything after the wrap is float32.
+            # Intermediates are updated in place (out=) rather than allocated per operation.
+            phase = np.multiply(t[None, :], freqs[b:b + rows, None] * (WAVETABLE_SIZE / sample_rate))
+            np.remainder(phase, WAVETABLE_SIZE, out=phase)
+            idx = phase.astype(np.int32)
+            np.subtract(phase, idx, out=phase)
+            frac = phase.astype(np.float32)
+            del phase
+            block = table[idx]
+            idx += 1
+            slope = table[idx]
+            np.subtract(slope, block, out=slope)
+            np.multiply(slope, frac, out=slope)
+            block += slope
+            block *= env
+            block *= gains[b:b + rows, None]
+
+            # Add to main buffer, without going out of bounds at the end
+            for row, start_idx in zip(block, starts[b:b + rows]):
+                end_idx = min(start_idx + total_note_len, num_samples)
+                audio[start_idx:end_idx] += row[:end_idx - start_idx]
+
+if HAS_NUMBA:
+    # cache=True stores the compiled kernel in __pycache__, so only the first run pays for JIT.
+    # nogil lets _render_in_parallel run it on several regions at once.
+    @njit(fastmath=True, cache=True, nogil=True)
+    def _render_notes_jit(events, audio, offset, sample_rate, att_len, dec_len, rel_len, sustain_level, table):
+        """
+        Same synthesis as _render_notes_numpy, fused into one pass per note with no temporaries.
+        Runs serially: overlapping notes add into the same samples.
+        """
+        num_samples = audio.shape[0]
+        size = table.shape[0] - 1
+        for i in range(events.shape[0]):
+            start_idx = int(events[i, 0] * sample_rate) - offset
+            gate_len = int(events[i, 1] * sample_rate)
+            freq = events[i, 2]
+            gain = events[i, 3] * 0.15
+
+            # Envelope breakpoints (mirrors the cursor logic of the NumPy path)
+            actual_att = min(att_len, gate_len)
+            current_val = 1.0
+            if gate_len < att_len:
+                current_val = actual_att / att_len
+            decay_start = current_val
+            actual_dec = 0
+            if gate_len > actual_att:
+                actual_dec = min(dec_len, gate_len - actual_att)
+                if actual_dec == dec_len:
+                    current_val = sustain_level
+                else:
+                    current_val = decay_start + (actual_dec - 1) * (sustain_level - decay_start) / dec_len
+            dec_end = actual_att + actual_dec
+
+            # Phase accumulator over the wavetable
+            phase = 0.0
+            inc = freq * size / sample_rate
+
+            # A release from zero is silent: stop at the end of the gate
+            note_len = gate_len + rel_len if current_val != 0.0 else gate_len
+            note_len = min(note_len, num_samples - start_idx)
+            for j in range(note_len):
+                if j < actual_att:
+                    env = j / actual_att
+                elif j < dec_end:
+                    env = decay_start + (j - actual_att) * (sustain_level - decay_start) / dec_len
+                elif j < gate_len:
+                    env = current_val
+                else:
+                    env = current_val - (j - gate_len) * current_val / rel_len
+                # Past the attack the envelope only falls, so the rest of the note is inaudible
+                if env < ENV_FLOOR and j >= actual_att:
+                    break
+
+                k = int(phase)
+                osc = table[k] + (phase - k) * (table[k + 1] - table[k])
+                phase += inc
+                while phase >= size:
+                    phase -= size
+
+                audio[start_idx + j] += osc * env * gain
+
+def _render_in_parallel(render, note_events, audio, sample_rate, rel_len, workers=None):
+    """
+    Splits the notes (sorted by start) into one run per worker, renders each run into its own
+    buffer covering just the samples it can touch, then adds the buffers into audio.
+    render(events, buf, offset) must mix events into buf, whose first sample is audio[offset].
+    """
+    workers = workers or os.cpu_count() or 1
+    # Small renders aren't worth the extra buffers
+    if workers < 2 or len(note_events) < 64:
+        render(note_events, audio, 0)
+        return
+
+    events = sorted(note_events)
+    run = -(-len(events) // workers)
+    regions = []
+    for i in range(0, len(events), run):
+        chunk = events[i:i + run]
+        offset = int(chunk[0][0] * sample_rate)
+        end = min(len(audio), max(int(start * sample_rate) + int(dur * sample_rate) + rel_len
+                                  for start, dur, _, _ in chunk))
+        regions.append((chunk, offset, end))
+
+    def render_region(chunk, offset, end):
+        buf = np.zeros(end - offset, dtype=np.float32)
+        render(chunk, buf, offset)
+        return buf
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(render_region, *region) for region in regions]
+        for (_, offset, end), future in zip(regions, futures):
+            audio[offset:end] += future.result()
+
+# Equal-tempered frequency of every MIDI note number (A4 = 440 Hz)
+BASE_FREQS = 440.0 * 2.0 ** ((np.arange(128) - 69) / 12.0)
+
+# Message kinds used by parse_note_events (everything else is 0 and ignored)
+NOTE_ON, NOTE_OFF, PITCHWHEEL, SET_TEMPO = 1, 2, 3, 4
+MSG_KIND_IDS = {'note_on': NOTE_ON, 'note_off': NOTE_OFF, 'pitchwheel': PITCHWHEEL}
+
+# mido's default tempo (microseconds per beat) before any set_tempo
+DEFAULT_TEMPO = 500000
+
+def _midi_messages_mido(mid):
+    """(delta_seconds, kind, channel, note, value) rows of a mido.MidiFile in playback order."""
+    rows = [(msg.time, MSG_KIND_IDS.get(msg.type, 0), getattr(msg, 'channel', 0), getattr(msg, 'note', 0),
+             msg.pitch if msg.type == 'pitchwheel' else getattr(msg, 'velocity', 0))
+            for msg in mid]
+    return np.array(rows, dtype=np.float64).reshape(-1, 5)
+
+if HAS_NUMBA:
+    @njit(cache=True)
+    def _read_varlen(buf, pos):
+        value = 0
+        while pos < buf.shape[0]:
+            byte = buf[pos]
+            pos += 1
+            value = (value << 7) | (byte & 0x7F)
+            if byte < 0x80:
+                return value, pos
+        return -1, pos
+
+    @njit(cache=True)
+    def _parse_smf_tracks(buf, pos, num_tracks):
+        """
+        Decodes the MTrk chunks of a Standard MIDI File into (abs_tick, kind, channel, note, value) rows,
+        track after track. Follows mido's reader (running status, end_of_track dropped).
+        Returns (rows, ok); ok is False for anything it does not handle, so the caller can fall back to mido.
+        """
+        n = buf.shape[0]
+        events = np.zeros((n // 2 + 1, 5), dtype=np.int64)
+        count = 0
+        for _ in range(num_tracks):
+            if pos + 8 > n or buf[pos] != 77 or buf[pos + 1] != 84 or buf[pos + 2] != 114 or buf[pos + 3] != 107:
+                return events[:count], False  # no 'MTrk' header
+            size = (np.int64(buf[pos + 4]) << 24) | (np.int64(buf[pos + 5]) << 16) | (np.int64(buf[pos + 6]) << 8) | np.int64(buf[pos + 7])
+            pos += 8
+            end = pos + size
+            if end > n:
+                return events[:count], False
+            tick = 0
+            running = -1
+            while pos < end:
+                delta, pos = _read_varlen(buf, pos)
+                if delta < 0 or pos >= end:
+                    return events[:count], False
+                tick += delta
+                status = np.int64(buf[pos])
+                if status < 0x80:
+                    if running < 0:
+                        return events[:count], False
+                    status = running
+                else:
+                    pos += 1
+                    if status != 0xFF:
+                        # Meta messages don't set running status
+                        running = status
+
+                kind = 0
+                channel = 0
+                note = 0
+                value = 0
+                if status == 0xFF:
+                    if pos >= end:
+                        return events[:count], False
+                    meta_type = buf[pos]
+                    length, pos = _read_varlen(buf, pos + 1)
+                    if length < 0 or pos + length > end:
+                        return events[:count], False
+                    if meta_type == 0x2F:
+                        # end_of_track: mido drops it when merging tracks
+                        pos += length
+                        continue
+                    if meta_type == 0x51:
+                        if length != 3:
+                            return events[:count], False
+                        kind = SET_TEMPO
+                        value = (np.int64(buf[pos]) << 16) | (np.int64(buf[pos + 1]) << 8) | np.int64(buf[pos + 2])
+                    pos += length
+                elif status == 0xF0 or status == 0xF7:
+                    length, pos = _read_varlen(buf, pos)
+                    if length < 0 or pos + length > end:
+                        return events[:count], False
+                    pos += length
+                elif status >= 0xF0:
+                    return events[:count], False  # system common/real-time in a file
+                else:
+                    high = status & 0xF0
+                    channel = status & 0x0F
+                    num_data = 1 if (high == 0xC0 or high == 0xD0) else 2
+                    if pos + num_data > end:
+                        return events[:count], False
+                    d1 = np.int64(buf[pos])
+                    d2 = np.int64(buf[pos + 1]) if num_data == 2 else 0
+                    if d1 > 127 or d2 > 127:
+                        return events[:count], False
+                    pos += num_data
+                    if high == 0x90:
+                        kind = NOTE_ON
+                        note = d1
+                        value = d2
+                    elif high == 0x80:
+                        kind = NOTE_OFF
+                        note = d1
+                        value = d2
+                    elif high == 0xE0:
+                        kind = PITCHWHEEL
+                        value = ((d2 << 7) | d1) - 8192
+
+                events[count, 0] = tick
+                events[count, 1] = kind
+                events[count, 2] = channel
+                events[count, 3] = note
+                events[count, 4] = value
+                count += 1
+        return events[:count], True
+
+def _midi_messages_smf(buf):
+    """
+    Same note/pitchwheel rows as _midi_messages_mido (meta rows differ), decoded straight
+    from the file bytes.
+    Returns None when the file needs mido (SMPTE timing, type 2, anything unusual).
+    """
+    if len(buf) < 14 or bytes(buf[:4]) != b'MThd':
+        return None
+    header_size = int.from_bytes(bytes(buf[4:8]), 'big')
+    file_type = int.from_bytes(bytes(buf[8:10]), 'big')
+    num_tracks = int.from_bytes(bytes(buf[10:12]), 'big')
+    ticks_per_beat = int.from_bytes(bytes(buf[12:14]), 'big')
+    if file_type == 2 or ticks_per_beat & 0x8000 or header_size < 6:
+        return None
+
+    events, ok = _parse_smf_tracks(buf, 8 + header_size, num_tracks)
+    if not ok:
+        return None
+    if len(events) == 0:
+        return np.zeros((0, 5))
+
+    # Merge tracks like mido: stable sort on absolute ticks, then back to deltas
+    events = events[np.argsort(events[:, 0], kind='stable')]
+    delta_ticks = np.diff(events[:, 0], prepend=0)
+
+    # Each delta is timed with the tempo set before it (mido's tick2second)
+    is_tempo = events[:, 1] == SET_TEMPO
+    last_tempo = np.maximum.accumulate(np.where(is_tempo, np.arange(len(events)), -1))
+    prev_tempo = np.concatenate(([-1], last_tempo[:-1]))
+    tempo = np.where(prev_tempo >= 0, events[np.maximum(prev_tempo, 0), 4], DEFAULT_TEMPO)
+    scale = tempo * 1e-6 / ticks_per_beat
+
+    messages = events.astype(np.float64)
+    messages[:, 0] = delta_ticks * scale
+    return messages
+
+def read_midi_messages(midi_path):
+    """
+    Reads a MIDI file as (delta_seconds, kind, channel, note, value) rows in playback order.
+    With Numba the file bytes are decoded by a compiled parser; otherwise (or for files that
+    parser does not handle) mido is used.
+    """
+    if HAS_NUMBA:
+        messages = _midi_messages_smf(np.fromfile(midi_path, dtype=np.uint8))
+        if messages is not None:
+            return messages
+    return _midi_messages_mido(mido.MidiFile(midi_path))
+
+def parse_note_events(messages, speed):
+    """
+    Derives note start times, pitch-bent frequencies and velocities from read_midi_messages rows
+    with array ops.
+
+    Returns: list of (start_time, duration, frequency, velocity) for notes longer than 5 ms
+    """
+    if len(messages) == 0:
+        return []
+
+    # Same running sum as adding msg.time / speed message by message (keeps sample offsets identical)
+    times = np.cumsum(messages[:, 0] / speed)
+    kind = messages[:, 1].astype(np.int64)
+    channel = messages[:, 2].astype(np.int64)
+    note = messages[:, 3]
+    value = messages[:, 4]
+    # A velocity 0 note_on is a note_off
+    kind[(kind == NOTE_ON) & (value == 0)] = NOTE_OFF
+
+    # Bend in effect at each message: forward-fill the last pitchwheel of its channel
+    # Pitch Bend Range: +/- 2 semitones (+/- 200 cents)
+    cents = (value / 8192.0) * 200.0
+    is_bend = kind == PITCHWHEEL
+    bend = np.zeros(len(messages))
+    pos = np.arange(len(messages))
+    for ch in np.unique(channel[is_bend]):
+        on_channel = channel == ch
+        last_bend = np.maximum.accumulate(np.where(is_bend & on_channel, pos, -1))
+        sel = on_channel & (last_bend >= 0)
+        bend[sel] = cents[last_bend[sel]]
+    freqs = BASE_FREQS[note.astype(np.int64)] * np.exp2(bend / 1200.0)
+
+    # Pair note_on/note_off per (channel, note)
+    note_events = []
+    active_notes = {}
+    kinds = kind.tolist()
+    channels = channel.tolist()
+    notes = note.tolist()
+    for i in np.flatnonzero((kind == NOTE_ON) | (kind == NOTE_OFF)).tolist():
+        key = (channels[i], notes[i])
+        if kinds[i] == NOTE_ON:
+            active_notes[key] = i
+        elif key in active_notes:
+            j = active_notes.pop(key)
+            duration = times[i] - times[j]
+            if duration > 0.005:
+                note_events.append((times[j], duration, freqs[j], value[j] / 127.0))
+    return note_events
+
 def render_mpe_to_audio_data(midi_path, sample_rate=44100, speed=1.2, waveform='sine', reverb=0):
     """
     Renders MPE MIDI to audio data (numpy array) with correct timing, pitch bends, and ADSR envelope.
@@ -108,7 +540,7 @@ def render_mpe_to_audio_data(midi_path, sample_rate=44100, speed=1.2, waveform='
         waveform: Waveform type - 'sine', 'triangle', 'square', or 'clarinet' (default 'sine')
         reverb: Reverb amount as percentage (0-100), 0=no reverb, 100=maximum reverb
     
-    Returns: (audio_data_int16, sample_rate)
+    Returns: (audio_data_int16, sample_rate); audio is mono (samples,) without reverb, (2, samples) with it
     """
     print(f"play_mpe | waveform: {waveform}, reverb: {reverb}%")
     midi_path = Path(midi_path)
@@ -117,44 +549,10 @@ def render_mpe_to_audio_data(midi_path, sample_rate=44100, speed=1.2, waveform='
         return None, None
 
     print(f"Loading {midi_path.name}...")
-    mid = mido.MidiFile(midi_path)
-
-    # Storage for note events: (start_time, duration, frequency, velocity)
-    note_events = []
-
-    # State tracking
-    channel_bends = {i: 0.0 for i in range(16)}
-    active_notes = {}
-
-    current_time = 0.0
+    messages = read_midi_messages(midi_path)
 
-    # Parse MIDI messages
-    for msg in mid:
-        current_time += msg.time / speed
-
-        if msg.type == "pitchwheel":
-            # Pitch Bend Range: +/- 2 semitones (+/- 200 cents)
-            cents = (msg.pitch / 8192.0) * 200.0
-            channel_bends[msg.channel] = cents
-
-        elif msg.type == "note_on" and msg.velocity > 0:
-            bend_cents = channel_bends.get(msg.channel, 0.0)
-            base_freq = 440.0 * (2 ** ((msg.note - 69) / 12.0))
-            freq = base_freq * (2 ** (bend_cents / 1200.0))
-
-            active_notes[(msg.channel, msg.note)] = (
-                current_time,
-                freq,
-                msg.velocity / 127.0,
-            )
-
-        elif msg.type == "note_off" or (msg.type == "note_on" and msg.velocity == 0):
-            key = (msg.channel, msg.note)
-            if key in active_notes:
-                start_time, freq, vel = active_notes.pop(key)
-                duration = current_time - start_time
-                if duration > 0.005:
-                    note_events.append((start_time, duration, freq, vel))
+    # Note events: (start_time, duration, frequency, velocity)
+    note_events = parse_note_events(messages, speed)
 
     if not note_events:
         print("⚠️ No notes found to render!")
@@ -178,106 +576,47 @@ def render_mpe_to_audio_data(midi_path, sample_rate=44100, speed=1.2, waveform='
     dec_len = int(decay_time * sample_rate)
     rel_len = int(release_time * sample_rate)
 
-    for start, dur, freq, vel in note_events:
-        start_idx = int(start * sample_rate)
-        gate_len = int(dur * sample_rate)
-
-        # Buffer for this note (Gate + Release)
-        total_note_len = gate_len + rel_len
-        env = np.zeros(total_note_len, dtype=np.float32)
-
-        # We use a cursor to fill the buffer sequentially
-        cursor = 0
-
-        # 1. Attack Phase
-        actual_att = min(att_len, gate_len)
-        if actual_att > 0:
-            env[0:actual_att] = np.linspace(0.0, 1.0, actual_att, endpoint=False)
-            cursor += actual_att
-
-        current_val = 1.0
-        if gate_len < att_len:
-            current_val = float(actual_att) / att_len
-        
-        # 2. Decay Phase
-        remaining_gate = gate_len - cursor
-        if remaining_gate > 0:
-            actual_dec = min(dec_len, remaining_gate)
-            decay_curve = np.linspace(current_val, sustain_level, dec_len, endpoint=False)
-            env[cursor : cursor + actual_dec] = decay_curve[:actual_dec]
-            cursor += actual_dec
-            
-            if actual_dec == dec_len:
-                current_val = sustain_level
-            else:
-                current_val = decay_curve[actual_dec-1]
-
-        # 3. Sustain Phase
-        remaining_gate = gate_len - cursor
-        if remaining_gate > 0:
-            env[cursor : cursor + remaining_gate] = current_val
-            cursor += remaining_gate
-
-        # 4. Release Phase
-        env[gate_len : gate_len + rel_len] = np.linspace(current_val, 0.0, rel_len, endpoint=False)
-
-        # Make sure we don't go out of bounds of the main audio buffer
-        end_idx = start_idx + len(env)
-        if end_idx > num_samples:
-              env = env[:num_samples - start_idx]
-              end_idx = num_samples
-
-        # Generate waveform oscillator
-        t = np.arange(len(env)) / sample_rate
-        p = 2 * np.pi * freq * t
-        
-        # Generate waveform based on selection
-        if waveform == 'sine':
-            # Pure sine wave
-            osc = np.sin(p)
-        elif waveform == 'triangle':
-            # Triangle wave (using Fourier series approximation)
-            osc = np.sin(p)
-            for n in range(3, 15, 2):  # Odd harmonics
-                osc += ((-1) ** ((n-1)/2)) * np.sin(n * p) / (n ** 2)
-            osc *= 8 / (np.pi ** 2)
-        elif waveform == 'square':
-            # Square wave (using Fourier series approximation)
-            osc = np.sin(p)
-            for n in range(3, 15, 2):  # Odd harmonics
-                osc += np.sin(n * p) / n
-            osc *= 4 / np.pi
-        elif waveform == 'clarinet':
-            # Clarinet-like (odd harmonics with specific weights)
-            osc = (1.0 * np.sin(p)) - (0.11 * np.sin(3 * p)) + (0.04 * np.sin(5 * p))
-        else:
-            # Default to sine
-            osc = np.sin(p)
+    if HAS_NUMBA:
+        table = WAVETABLES[WAVEFORM_IDS.get(waveform, 0)]
+        def render(events, buf, offset):
+            _render_notes_jit(np.asarray(events, dtype=np.float64), buf, offset, sample_rate,
+                              att_len, dec_len, rel_len, sustain_level, table)
+    else:
+        def render(events, buf, offset):
+            _render_notes_numpy(events, buf, offset, sample_rate, att_len, dec_len, rel_len, sustain_level, waveform)
 
-        # Add to main buffer
-        audio[start_idx:end_idx] += osc * env * vel * 0.15
+    _render_in_parallel(render, note_events, audio, sample_rate, rel_len)
 
     # Apply reverb if requested (returns stereo)
+    # Without reverb the audio stays mono, players upmix it;
+    # with reverb it is already in (channels, samples) format for audio players
     if reverb > 0:
         audio = apply_reverb(audio, sample_rate, reverb)
-        # Normalize stereo
-        peak = np.max(np.abs(audio))
-        if peak > 0:
-            audio = audio / peak * 0.95
-        audio_int16 = (audio * 32767).astype(np.int16)
-        # Transpose to (channels, samples) format for audio players
-        audio_int16 = audio_int16.T
-    else:
-        # No reverb - convert mono to stereo
-        peak = np.max(np.abs(audio))
-        if peak > 0:
-            audio = audio / peak * 0.95
-        audio_mono = (audio * 32767).astype(np.int16)
-        # Create stereo in (channels, samples) format
-        audio_int16 = np.vstack([audio_mono, audio_mono])
+
+    # Normalize to 95% of full scale with a single in-place multiply, then convert
+    peak = max(audio.max(), -audio.min())
+    scale = 32767.0
+    if peak > 0:
+        scale *= 0.95 / peak
+    audio *= scale
+    audio_int16 = audio.astype(np.int16)
     
     return audio_int16, sample_rate
 
+def write_wav(file, audio_data, sample_rate, block_size=65536):
+    """
+    Writes int16 audio, (channels, samples) or mono, as a 16-bit PCM WAV.
+    Frames are interleaved and written one block at a time, so no full interleaved copy is built.
+    """
+    channels = np.atleast_2d(audio_data)
+    with wave.open(file, 'wb') as wf:
+        wf.setnchannels(channels.shape[0])
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        for i in range(0, channels.shape[1], block_size):
+            block = channels[:, i:i + block_size].T.astype('<i2')
+            wf.writeframes(block.tobytes())
+
 def play_audio_data(audio_data, sample_rate):
     """
     Plays audio data using a temporary file and platform-specific command.
@@ -292,7 +631,7 @@ def play_audio_data(audio_data, sample_rate):
     try:
         with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tf:
             temp_filename = tf.name
-            wavfile.write(tf, sample_rate, audio_data)
+            write_wav(tf, audio_data, sample_rate)
         
         print(f"Playing...")
         
@@ -10,28 +10,31 @@ sys.path.append('/Users/david/ANIMA_Data_Formation/src')
 from utils import export_all_metadata_from_xml, get_metadata
 import json
 
-# Test single file first
-print("Testing single file metadata extraction...")
-test_xml = "../dataset/iRealXML/A Night In Tunisia.xml"
-metadata = get_metadata(test_xml)
-
-print("\nExtracted metadata:")
-for key, value in metadata.items():
-    print(f"  {key}: {value}")
-
-# Export all metadata
-print("\n" + "="*60)
-print("Exporting all metadata to JSON files...")
-print("="*60 + "\n")
-
-exported_files = export_all_metadata_from_xml(
-    xml_dir="../dataset/iRealXML",
-    output_dir="../dataset/metadata"
-)
-
-print(f"\n✅ Successfully exported {len(exported_files)} metadata files!")
-
-# Show a few examples
-print("\nFirst 5 exported files:")
-for f in exported_files[:5]:
-    print(f"  - {f}")
+# the export runs on a process pool, which re-imports this script in every worker
+# on spawn-based platforms (macOS, Windows), so the work has to sit behind the guard
+if __name__ == '__main__':
+    # Test single file first
+    print("Testing single file metadata extraction...")
+    test_xml = "../dataset/iRealXML/A Night In Tunisia.xml"
+    metadata = get_metadata(test_xml)
+
+    print("\nExtracted metadata:")
+    for key, value in metadata.items():
+        print(f"  {key}: {value}")
+
+    # Export all metadata
+    print("\n" + "="*60)
+    print("Exporting all metadata to JSON files...")
+    print("="*60 + "\n")
+
+    exported_files = export_all_metadata_from_xml(
+        xml_dir="../dataset/iRealXML",
+        output_dir="../dataset/metadata"
+    )
+
+    print(f"\n✅ Successfully exported {len(exported_files)} metadata files!")
+
+    # Show a few examples
+    print("\nFirst 5 exported files:")
+    for f in exported_files[:5]:
+        print(f"  - {f}")
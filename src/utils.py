@@ -1,198 +1,235 @@
 from pathlib import Path
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, DataLoader
 import torch
 import numpy as np
-import xml.etree.ElementTree as ET
+try:
+    from lxml import etree as ET
+    HAS_LXML = True
+except ImportError:
+    import xml.etree.ElementTree as ET
+    HAS_LXML = False
 from tqdm.auto import tqdm
 from midiutil import MIDIFile
 
 import formats as fmt
+from voicing import chord_note_schedule
 import librosa as lib
 import utils_lenghts as lengths
 import random
 import math
+import mmap
 import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+#parser options shared by every song file; comments and PIs are dropped so a part
+#yields only measures, the same as the stdlib parser. collect_ids is left alone on
+#purpose: turning it off makes libxml2 fetch the MusicXML DOCTYPE over the network
+XML_PARSE_OPTIONS = {'huge_tree': False, 'remove_blank_text': True, 'remove_comments': True,
+                     'remove_pis': True, 'resolve_entities': False, 'no_network': True}
+
+#note names seen in keys and bass tokens, resolved by librosa once at import
+_NOTE_TO_MIDI = {letter + accidental: lib.note_to_midi(letter + accidental)
+                 for letter in 'CDEFGAB' for accidental in ('', '#', 'b', '##', 'bb')}
+
+def _note_to_midi(note):
+    #anything outside the preloaded names still goes through librosa (and its errors)
+    m = _NOTE_TO_MIDI.get(note)
+    if m is None:
+        m = _NOTE_TO_MIDI[note] = lib.note_to_midi(note)
+    return m
+
+#music21-style flats ('B-') to the names librosa understands ('Bb')
+_DASH_TO_B = str.maketrans('-', 'b')
+
+#structural tokens of a song sequence
+_SPECIAL = frozenset({'<start>', '<end>', '<pad>'})
+_SPECIAL_OR_DOT = _SPECIAL | {'.'}
 
 # some by default declarations
+_NOTES = ('C', 'D', 'E', 'F', 'G', 'A', 'B', 'F#', 'C#', 'G#', 'D#', 'A#', 'Bb', 'Eb', 'Ab', 'Db', 'Gb', 'Cb')
+_FORMAT = ('.', '<start>', '<end>', '<pad>')
+_FIFTH_CYCLE = lengths.getFifthCicle()
+
 def getNotes():
-    notes = ['C', 'D', 'E', 'F', 'G', 'A', 'B', 'F#', 'C#', 'G#', 'D#', 'A#', 'Bb', 'Eb', 'Ab', 'Db', 'Gb', 'Cb']
-    return notes
+    return _NOTES
 
 def getFormat():
-    format = ['.', '<start>', '<end>', '<pad>']
-    return format
+    return _FORMAT
 
 #-------------------------------------------------------------------------
 #Get the metadata and chords from the XML files 
-def createCustomDataset(path, padding_length=512, onlyFourByFour=True):
+def map_song_files(func, paths, workers=None):
+    #every song is parsed independently, so spread them over a process pool;
+    #results come back in the order of paths
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers < 2 or len(paths) < 2:
+        yield from map(func, paths)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(func, paths, chunksize=16)
+
+def _load_song(song_path, onlyFourByFour):
+    meta_info = get_metadata(song_path)
+    if onlyFourByFour:  
+        if (meta_info['time_signature'] == '4/4') or (meta_info['time_signature'] == '2/4'): 
+            durations, relative_positions, chords, bass_notes = get_chords_from_file(song_path, False)
+        else:
+            return None
+    else:
+        durations, relative_positions, chords, bass_notes = get_chords_from_file(song_path)
+    return bass_notes, durations, chords, relative_positions, meta_info
+
+def createCustomDataset(path, padding_length=512, onlyFourByFour=True, workers=None):
     
-    songFiles = []
-    #first get only the .xml files to avoid hidden files as .DS_Store
-    for item in os.listdir(path):
-        if item.endswith('.xml') and os.path.isfile(os.path.join(path, item)):
-            songFiles.append(item)
-
-    #sort the songs in alphabetical order
-    songFiles.sort()
-    all_bass_notes = []
-    all_durations = []
-    all_chords = []
-    all_relative_pos = []
+    #first get only the .xml files to avoid hidden files as .DS_Store, sorted in
+    #alphabetical order (DirEntry.is_file reuses the type from the directory listing)
+    with os.scandir(path) as entries:
+        songFiles = sorted(e.name for e in entries if e.name.endswith('.xml') and e.is_file())
+
+    song_paths = [path + '/' + item for item in songFiles]
+    load = partial(_load_song, onlyFourByFour=onlyFourByFour)
+
+    #pad by writing every song straight into one preallocated block per column, sized
+    #for every file; rows of filtered songs are trimmed off with a view at the end
+    all_bass_notes = np.full((len(song_paths), padding_length), '<pad>', dtype=object)
+    all_durations = np.full((len(song_paths), padding_length), '<pad>', dtype=object)
+    all_chords = np.full((len(song_paths), padding_length), '<pad>', dtype=object)
+    all_relative_pos = np.full((len(song_paths), padding_length), '<pad>', dtype=object)
     meta = []
-
-    for item in tqdm(songFiles):
-        song_path = path + '/' + item
-        meta_info = get_metadata(song_path)
-        if onlyFourByFour:  
-            if (meta_info['time_signature'] == '4/4') or (meta_info['time_signature'] == '2/4'): 
-                meta.append(meta_info)
-                durations, relative_positions, chords, bass_notes = get_chords_from_file(song_path, False)
-                #pad the arrays to the max length
-                bass_notes = padding(bass_notes, padding_length)
-                durations = padding(durations, padding_length)
-                chords = padding(chords, padding_length)
-                relative_positions = padding(relative_positions, padding_length)
-                #append all arrays to the defined length
-                all_bass_notes.append(bass_notes)
-                all_durations.append(durations)
-                all_chords.append(chords)
-                all_relative_pos.append(relative_positions)
-        else:
-            meta.append(meta_info)
-            durations, relative_positions, chords, bass_notes = get_chords_from_file(song_path)
-            #pad the arrays to the max length
-            bass_notes = padding(bass_notes, padding_length)
-            durations = padding(durations, padding_length)
-            chords = padding(chords, padding_length)
-            relative_positions = padding(relative_positions, padding_length)
-            #append all arrays to the defined length
-            all_bass_notes.append(bass_notes)
-            all_durations.append(durations)
-            all_chords.append(chords)
-            all_relative_pos.append(relative_positions)
-            
-    all_relative_pos = np.array(all_relative_pos, object)
-    all_bass_notes = np.array(all_bass_notes)
-    all_durations = np.array(all_durations)
-    all_chords = np.array(all_chords)
+    for song in tqdm(map_song_files(load, song_paths, workers), total=len(song_paths)):
+        if song is None:
+            continue
+        bass_notes, durations, chords, relative_positions, meta_info = song
+        assert max(len(bass_notes), len(durations), len(chords), len(relative_positions)) <= padding_length
+        i = len(meta)
+        all_bass_notes[i, :len(bass_notes)] = bass_notes
+        all_durations[i, :len(durations)] = durations
+        all_chords[i, :len(chords)] = chords
+        all_relative_pos[i, :len(relative_positions)] = relative_positions
+        meta.append(meta_info)
+    n = len(meta)
+    all_bass_notes, all_durations, all_chords, all_relative_pos = all_bass_notes[:n], all_durations[:n], all_chords[:n], all_relative_pos[:n]
     #meta = np.array(meta)
     return all_bass_notes, all_durations, all_chords, all_relative_pos, meta
 
+#-------------------------------------------------------------------------
+def encode_tokens(dataset, stoi):
+    #map the whole (n x L) token array to ids once: every distinct token is looked up
+    #a single time and the ids are scattered back through the inverse index
+    dataset = np.asarray(dataset)
+    uniques, inverse = np.unique(dataset, return_inverse=True)
+    lut = np.array([stoi[s] for s in uniques], dtype=np.int64)
+    return lut[inverse].reshape(dataset.shape)
+
 #-------------------------------------------------------------------------
 class TokenDatasetMidi(Dataset):
     def __init__(self, dataset, midi_dataset, block_size, tokens):
         self.dataset = dataset
         #print("midi shape:", midi_dataset.shape)
-        self.midi_dataset = midi_dataset #n x L:512 x 8
+        #contiguous int64 so every sample is a zero-copy torch.from_numpy view
+        self.midi_dataset = np.ascontiguousarray(midi_dataset, dtype=np.int64) #n x L:512 x 8
         data_size, vocab_size = len(self.dataset ), len(tokens)
         print('data has %d pieces, %d unique tokens.' % (data_size, vocab_size))
         self.stoi = { tk:i for i,tk in enumerate(tokens) }
         self.itos = { i:tk for i,tk in enumerate(tokens) }
         self.block_size = block_size
         self.vocab_size = vocab_size
+        # encode every token to an integer
+        self.dataset_ids = encode_tokens(dataset, self.stoi)
         
     def __len__(self):
         return len(self.dataset)
 
     def __getitem__(self, idx):
-        chunk = self.dataset[idx:idx+1]
-        midi = self.midi_dataset[idx:idx+1][0] # 1 x 512 x 8
-        
-        #print(midi.shape)
-        # encode every token to an integer
-        dix = [self.stoi[s] for s in chunk[0]]
+        row = self.dataset_ids[idx]
+        midi = self.midi_dataset[idx] # 512 x 8
         
-        x = torch.tensor(dix[:-1], dtype=torch.long)
-        y = torch.tensor(dix[1:], dtype=torch.long)
-        m = torch.tensor(midi[:-1], dtype=torch.long)
+        x = torch.from_numpy(row[:-1])
+        y = torch.from_numpy(row[1:])
+        m = torch.from_numpy(midi[:-1])
         
         return x, y, m
 
-#-------------------------------------------------------------------------
 #-------------------------------------------------------------------------
 class TokenDatasetMidiEigen(Dataset):
     """Dataset that returns (x, y, m, e) — tokens, targets, midi, eigenspace coords."""
     def __init__(self, dataset, midi_dataset, eigen_dataset, block_size, tokens):
         self.dataset = dataset
-        self.midi_dataset = midi_dataset      # n x L x 8
-        self.eigen_dataset = eigen_dataset    # n x L x 4  (α, β, γ, D) per token
-        data_size, vocab_size = len(self.dataset), len(tokens)
-        print('data has %d pieces, %d unique tokens (with EigenSpace).' % (data_size, vocab_size))
-        self.stoi = { tk:i for i,tk in enumerate(tokens) }
-        self.itos = { i:tk for i,tk in enumerate(tokens) }
-        self.block_size = block_size
-        self.vocab_size = vocab_size
-        
-    def __len__(self):
-        return len(self.dataset)
-
-    def __getitem__(self, idx):
-        chunk = self.dataset[idx:idx+1]
-        midi = self.midi_dataset[idx:idx+1][0]    # 512 x 8
-        eigen = self.eigen_dataset[idx:idx+1][0]  # 512 x 4
-        
-        dix = [self.stoi[s] for s in chunk[0]]
-        
-        x = torch.tensor(dix[:-1], dtype=torch.long)
-        y = torch.tensor(dix[1:], dtype=torch.long)
-        m = torch.tensor(midi[:-1], dtype=torch.long)
-        e = torch.tensor(eigen[:-1], dtype=torch.float32)
-        
-        return x, y, m, e
-
-#-------------------------------------------------------------------------class TokenDatasetMidiEigen(Dataset):
-    """Dataset that returns (x, y, m, e) — token IDs, targets, MIDI, and EigenSpace coords."""
-    def __init__(self, dataset, midi_dataset, eigen_dataset, block_size, tokens):
-        self.dataset = dataset
-        self.midi_dataset = midi_dataset    # n x L:512 x 8
-        self.eigen_dataset = eigen_dataset  # n x L:512 x 4  (α, β, γ, D)
+        self.midi_dataset = np.ascontiguousarray(midi_dataset, dtype=np.int64)       # n x L x 8
+        self.eigen_dataset = np.ascontiguousarray(eigen_dataset, dtype=np.float32)   # n x L x 4  (α, β, γ, D) per token
         data_size, vocab_size = len(self.dataset), len(tokens)
         print('data has %d pieces, %d unique tokens (with EigenSpace).' % (data_size, vocab_size))
         self.stoi = { tk:i for i,tk in enumerate(tokens) }
         self.itos = { i:tk for i,tk in enumerate(tokens) }
         self.block_size = block_size
         self.vocab_size = vocab_size
+        self.dataset_ids = encode_tokens(dataset, self.stoi)
         
     def __len__(self):
         return len(self.dataset)
 
     def __getitem__(self, idx):
-        chunk = self.dataset[idx:idx+1]
-        midi = self.midi_dataset[idx:idx+1][0]    # 512 x 8
-        eigen = self.eigen_dataset[idx:idx+1][0]  # 512 x 4
-        
-        # encode every token to an integer
-        dix = [self.stoi[s] for s in chunk[0]]
+        row = self.dataset_ids[idx]
+        midi = self.midi_dataset[idx]    # 512 x 8
+        eigen = self.eigen_dataset[idx]  # 512 x 4
         
-        x = torch.tensor(dix[:-1], dtype=torch.long)
-        y = torch.tensor(dix[1:], dtype=torch.long)
-        m = torch.tensor(midi[:-1], dtype=torch.long)
-        e = torch.tensor(eigen[:-1], dtype=torch.float32)
+        x = torch.from_numpy(row[:-1])
+        y = torch.from_numpy(row[1:])
+        m = torch.from_numpy(midi[:-1])
+        e = torch.from_numpy(eigen[:-1])
         
         return x, y, m, e
 
-#-------------------------------------------------------------------------class TokenDataset(Dataset):
+#-------------------------------------------------------------------------
+class TokenDataset(Dataset):
     def __init__(self, dataset, block_size, tokens):
         self.dataset = dataset
-        #print("midi shape:", midi_dataset.shape)
         data_size, vocab_size = len(self.dataset ), len(tokens)
         print('data has %d pieces, %d unique tokens.' % (data_size, vocab_size))
         self.stoi = { tk:i for i,tk in enumerate(tokens) }
         self.itos = { i:tk for i,tk in enumerate(tokens) }
         self.block_size = block_size
         self.vocab_size = vocab_size
+        self.dataset_ids = encode_tokens(dataset, self.stoi)
+
+    @classmethod
+    def from_tokens(cls, dataset, tokens, block_size):
+        #keep only the int64 ids so DataLoader workers do not carry the string array
+        ds = cls(dataset, block_size, tokens)
+        ds.dataset = None
+        return ds
         
     def __len__(self):
-        return len(self.dataset)
+        return len(self.dataset_ids)
 
     def __getitem__(self, idx):
-        chunk = self.dataset[idx:idx+1]
-        # encode every token to an integer
-        dix = [self.stoi[s] for s in chunk[0]]
-        x = torch.tensor(dix[:-1], dtype=torch.long)
-        y = torch.tensor(dix[1:], dtype=torch.long)
+        row = self.dataset_ids[idx]
+        x = torch.from_numpy(row[:-1])
+        y = torch.from_numpy(row[1:])
         
         return x, y
+
+def make_loader(ds, batch_size, num_workers=None, shuffle=False, pin_memory=None):
+    #worker processes stay alive between epochs and keep a few batches queued;
+    #prefetch_factor/persistent_workers are only valid when there are workers.
+    #pinned memory only helps copies to a CUDA device, so by default it is on only there
+    if num_workers is None:
+        num_workers = os.cpu_count() or 0
+    if pin_memory is None:
+        pin_memory = torch.cuda.is_available()
+    kwargs = {'batch_size': batch_size, 'shuffle': shuffle, 'pin_memory': pin_memory, 'num_workers': num_workers}
+    if num_workers > 0:
+        kwargs['persistent_workers'] = True
+        kwargs['prefetch_factor'] = 4
+    return DataLoader(ds, **kwargs)
     
 #Dummy format ----------------------------------------------------------
 def format_start_end(myData):
@@ -212,88 +249,88 @@ def get_project_root() -> Path:
     return Path(__file__).parent.parent
 
 #extract the metadata from the file -------------------------------------
+MMAP_MIN_SIZE = 4096 #smaller files are read directly, mapping them costs more than it saves
+
+def _iterparse(source):
+    if HAS_LXML:
+        return ET.iterparse(source, events=('end',), **XML_PARSE_OPTIONS)
+    return ET.iterparse(source, events=('end',))
+
+def iterparse_xml(path):
+    #stream 'end' events so a song never has to sit in memory as a full tree; larger
+    #files are parsed straight off a read-only memory map instead of chunked read() calls
+    if os.path.getsize(path) <= MMAP_MIN_SIZE:
+        yield from _iterparse(path)
+        return
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        yield from _iterparse(buf)
+
+def release_element(elem):
+    #drop a processed element and, with lxml, the already-cleared siblings before it
+    elem.clear()
+    if HAS_LXML:
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
 def get_metadata(path):
     metadata = {'composer': 'Null', 'style': 'Null', 'song_name': 'Null', 'tonality': 'Null', 'midi_key': 0, 'time_signature': '4/4', 'decade': 'Null'}
-    tree = ET.parse(path)
-    
-    #get version of xml
-    #print(ET.VERSION)
-    
-    root = tree.getroot()
-   #print(root)
-    #parse the name of the song
-  
-    title = 'None'
-    
-    # Attempt to find an element under the root
-    title_element = root.find('work')
-    
-    if title_element != None:
-        title = title_element.find('work-title').text        
-    else:
-        title = root.find('movement-title').text
-
-    part = root.find('part')
-    #define the metadata elements
-
-    #released_year = 'Null'
-
-    mode = 'major' # major, minor, 0, -1, etc
 
-    #Extract metadata 
-    info = root.find('identification').findall('creator')
-
-    metadata['song_name'] = title
-    metadata['composer'] = info[0].text if len(info) > 0 else 'Unknown'
-    metadata['style'] = info[1].text if len(info) > 1 else 'Unknown'
-    
-    # Extract additional metadata from identification section
-    identification = root.find('identification')
-    if identification is not None:
-        # Encoding info (software, date)
-        encoding = identification.find('encoding')
-        if encoding is not None:
-            software = encoding.find('software')
-            encoding_date = encoding.find('encoding-date')
-            if software is not None:
-                metadata['software'] = software.text
-            if encoding_date is not None:
-                metadata['encoding_date'] = encoding_date.text
-
-    #print('Composer: ', metadata['composer'], '\nStyle: ', metadata['style'], '\nSong name: ',metadata['song_name'])
+    #the header (work, identification) closes before the first part, so everything is
+    #collected in a single streaming pass that stops at the end of the first part
+    has_work = False
+    work_title = None
+    movement_title = None
+    info = []
+    encoding_info = {}
 
     #Extract the time signature
     total_notes_length = 0
     total_bars = 0 
     length_reference = 0.000325520834 #this is 1/3072 (samples for whole note)
-    dict_fifth_cycle = lengths.getFifthCicle()
-    for measure in part:
-        #print('bar: ', measure.attrib['number'])
-        total_bars = int(measure.attrib['number'])
-        if(measure.attrib['number'] == '1'):
-            data = measure.find('attributes')
-            key = data.find('key').find('fifths').text
-            mode = data.find('key').find('mode').text
-            metadata['tonality'] = dict_fifth_cycle[mode][key]+ " " + mode
-            #print('Tonality: ', metadata['tonality'])
-            midi_key = lib.note_to_midi(dict_fifth_cycle[mode][key])
-            metadata['midi_key'] = midi_key
-            #print('Midi key tonality: ', metadata['midi_key'])
-        #harmony_section = measure.findall('harmony')
-        notes = measure.findall('note')
-        notes_length_in_bar = 0
-        for note in notes:
-            duration = int(note.find('duration').text)
-            duration_samples = length_reference * duration
-            notes_length_in_bar += duration_samples
-        
-        total_notes_length += notes_length_in_bar
+    for _, elem in iterparse_xml(path):
+        tag = elem.tag
+        if tag == 'measure':
+            total_bars = int(elem.attrib['number'])
+            if(elem.attrib['number'] == '1'):
+                data = elem.find('attributes')
+                key = data.find('key').find('fifths').text
+                mode = data.find('key').find('mode').text
+                metadata['tonality'] = _FIFTH_CYCLE[mode][key]+ " " + mode
+                midi_key = _note_to_midi(_FIFTH_CYCLE[mode][key])
+                metadata['midi_key'] = midi_key
+            bar_units = sum(int(note.findtext('duration', '0')) for note in elem.iterfind('note'))
+            total_notes_length += length_reference * bar_units
+            release_element(elem)
+        elif tag == 'part':
+            break
+        elif tag == 'work':
+            has_work = True
+            work_title = elem.find('work-title').text
+        elif tag == 'movement-title':
+            movement_title = elem.text
+        elif tag == 'identification':
+            #Extract metadata
+            info = [creator.text for creator in elem.findall('creator')]
+            # Encoding info (software, date)
+            encoding = elem.find('encoding')
+            if encoding is not None:
+                software = encoding.find('software')
+                encoding_date = encoding.find('encoding-date')
+                if software is not None:
+                    encoding_info['software'] = software.text
+                if encoding_date is not None:
+                    encoding_info['encoding_date'] = encoding_date.text
+
+    metadata['song_name'] = work_title if has_work else movement_title
+    metadata['composer'] = info[0] if len(info) > 0 else 'Unknown'
+    metadata['style'] = info[1] if len(info) > 1 else 'Unknown'
+    metadata.update(encoding_info)
+
     divisor = '/4'
     time_signature = round(total_notes_length)*4 / total_bars
     if time_signature == 6:
         divisor = '/8'
     metadata['time_signature'] = str(int(time_signature)) + divisor
-    #print('Time_signature:', metadata['time_signature'])
     return metadata
 
 #Get the midi notes from the chords --------------------------------------------
@@ -302,101 +339,117 @@ def createMidiAndChord(chordList):
     nature = getArrayOfElementsInChord(chordList)
     nature.pop() #remove the last element
 
-    elements_per_chord=[]
-    counter = 0
-    for element in nature:
-        if element != '.' and element != '<start>' and element != '<end>' and element != '<pad>':
-            counter += 1
-        if element == '.':
-            elements_per_chord.append(counter)
-            counter = 0
-
+    #specials and '.' get an empty row, every other element takes the embedding of the
+    #chord opened by the last '.' (ref = dots seen so far - 1)
+    nature_arr = np.asarray(nature)
+    is_dot = nature_arr == '.'
+    is_chord = ~(is_dot | np.isin(nature_arr, list(_SPECIAL)))
+    ref_idx = np.cumsum(is_dot) - 1
+
+    #elements of each chord = chord elements between consecutive dots (the tail after
+    #the last dot is not a chord yet)
+    dots = np.flatnonzero(is_dot)
+    if len(dots):
+        elements_per_chord = np.add.reduceat(is_chord[:dots[-1]+1].astype(np.int64), np.r_[0, dots[:-1]+1]).tolist()
+    else:
+        elements_per_chord = []
     elements_per_chord.remove(0)
 
-    song_midi_embeddings = []
-    x = 0
-    ref = -1
-    for element in nature:
-        if element == '<start>' or element == '<end>' or element == '<pad>':
-            song_midi_embeddings.append(np.zeros(8))
-        if element == '.':
-            x += 1
-            ref += 1
-            song_midi_embeddings.append(np.zeros(8))
-        elif element != '<start>' and element != '<end>' and element != '<pad>':
-            song_midi_embeddings.append(midi_embeddings[ref])
-
-    song_midi_embeddings = np.array(song_midi_embeddings)
+    song_midi_embeddings = np.zeros((len(nature_arr), 8), dtype=np.int16) #midi values are <= 127
+    song_midi_embeddings[is_chord] = np.asarray(midi_embeddings)[ref_idx[is_chord]]
     return nature, song_midi_embeddings
 
 #Counter of elements in chord ---------------------------------------------------
 def counterOfElementsInChord(song):
-    add = 0
-    counter = [0, 0] #first two element are <style> and the actual style 
-    for i in range(2, len(song)):
-        e = song[i]
-        if e == '<start>' or e == '<end>' or e == '<pad>' or e == '.':
-            add = 0
-            counter.append(add)
-        else: 
-            add += 1
-            counter.append(add)
-    return counter
+    #first two element are <style> and the actual style; after that count the position
+    #of each element since the last separator, separators themselves count 0
+    tokens = np.asarray(song[2:])
+    is_sep = np.isin(tokens, list(_SPECIAL_OR_DOT))
+    idx = np.arange(len(tokens))
+    last_sep = np.maximum.accumulate(np.where(is_sep, idx, -1)) if len(tokens) else idx
+    counter = np.where(is_sep, 0, idx - last_sep)
+    return [0, 0] + counter.tolist()
 
 #Correct the padding for midi --------------------------------------------------
-def correctMidiEmbeddings(midi, data, theCounter):
-    theCounter = theCounter + [0,0]
-
-    for i in range(len(data)-1):
-        note = data[i]
+def _apply_midi_fixes(midi, base_here, chord_before_slash, is_slash, base_after_slash,
+                      root_before_slash, nature_extension, base_midi, chords):
+    #replays the correction rules in token order so later rules still overwrite earlier ones
+    for i in range(base_here.shape[0]):
         #correct the base after the nature being shure it is not a slash
-        if theCounter[i+1] == 2 and data[i+1] != '/':
-            if note.find('-') != -1:
-                note = note.replace('-', 'b')
-            m = lib.note_to_midi(note) + 48
-            midi[i] = [m] + [0,0,0,0,0,0,0]
+        if base_here[i]:
+            midi[i, :] = 0
+            midi[i, 0] = base_midi[i]
         #correct the nature after the base before a slash
-        if theCounter[i] == 2 and data[i] != '/' and data[i+1] == '/':
-            symbol = data[i-1] + data[i]
-            newChord = createChord(symbol)
-            midi[i] = newChord
+        if chord_before_slash[i] >= 0:
+            midi[i, :] = chords[chord_before_slash[i]]
         #correct that slash is an special midi embedding
-        if data[i] == '/':
-            midi[i] = [0,0,0,0,0,0,0,127]
+        if is_slash[i]:
+            midi[i, :] = 0
+            midi[i, 7] = 127
         #correct the base after the slash when it has nature
-        if data[i] == '/' and theCounter[i+2] == 5:
-            note = data[i+1]
-            if note.find('-') != -1:
-                note = note.replace('-', 'b')
-            m = lib.note_to_midi(note) + 48
-            midi[i+1] = [m] + [0,0,0,0,0,0,0]
+        if base_after_slash[i]:
+            midi[i+1, :] = 0
+            midi[i+1, 0] = base_midi[i+1]
         #correct the chord before the slash in the case there is no nature
-        if data[i+1] == '/' and theCounter[i] == 1:
-            symbol = data[i]
-            newChord = createChord(symbol)
-            midi[i] = newChord
+        if root_before_slash[i] >= 0:
+            midi[i, :] = chords[root_before_slash[i]]
         #correct the nature before an extension without slash
-        if theCounter[i] == 1 and theCounter[i+1] == 2 and theCounter[i+2] == 3 and data[i+1] != '/' and data[i+2] != '/':
-            symbol = data[i] + data[i+1]
-            newChord = createChord(symbol)
-            midi[i+1] = newChord
-    
+        if nature_extension[i] >= 0:
+            midi[i+1, :] = chords[nature_extension[i]]
+
+if HAS_NUMBA:
+    _apply_midi_fixes = njit(cache=True)(_apply_midi_fixes)
+
+def correctMidiEmbeddings(midi, data, theCounter):
+    #the rules only depend on the counter and on where the slashes are, so they are
+    #resolved to masks here; note names and chord symbols are converted once each in
+    #Python and the ordered writes into the int16 matrix run in _apply_midi_fixes
+    n = len(data)
+    if len(midi) < n:
+        raise IndexError('midi has fewer rows than data')
     last = data[-1]
+    counter = np.zeros(n + 2, dtype=np.int64)
+    counter[:len(theCounter)] = theCounter
+    slash = np.zeros(n + 2, dtype=np.bool_)
+    slash[:n] = [element == '/' for element in data]
+    c0, c1, c2 = counter[:n-1], counter[1:n], counter[2:n+1]
+    s0, s1, s2 = slash[:n-1], slash[1:n], slash[2:n+1]
+
+    base_here = (c1 == 2) & ~s1
+    base_after_slash = s0 & (c2 == 5)
+    base_midi = np.zeros(n, dtype=np.int16)
+    for i in np.flatnonzero(base_here):
+        base_midi[i] = _note_to_midi(data[i].translate(_DASH_TO_B)) + 48
+    for i in np.flatnonzero(base_after_slash) + 1:
+        base_midi[i] = _note_to_midi(data[i].translate(_DASH_TO_B)) + 48
+
+    symbols = {}
+    def chord_index(mask, symbol_at):
+        idx = np.full(n - 1 if n else 0, -1, dtype=np.int64)
+        for i in np.flatnonzero(mask):
+            idx[i] = symbols.setdefault(symbol_at(i), len(symbols))
+        return idx
+    chord_before_slash = chord_index((c0 == 2) & ~s0 & s1, lambda i: data[i-1] + data[i])
+    root_before_slash = chord_index(s1 & (c0 == 1), lambda i: data[i])
+    nature_extension = chord_index((c0 == 1) & (c1 == 2) & (c2 == 3) & ~s1 & ~s2, lambda i: data[i] + data[i+1])
+    chords = np.zeros((len(symbols), 8), dtype=np.int16)
+    for symbol, k in symbols.items():
+        chords[k] = createChord(symbol)
+
+    out = np.zeros((len(midi) + (last == '.'), 8), dtype=np.int16)
+    out[:len(midi)] = midi
+    _apply_midi_fixes(out, base_here, chord_before_slash, s0, base_after_slash,
+                      root_before_slash, nature_extension, base_midi, chords)
+
     if (last) != '.' and len(last) <= 2 and last.isnumeric() == False:
-        m = lib.note_to_midi(last) + 48
-        midi[-1] = [m] + [0,0,0,0,0,0,0]
-    if last == '.':
-        midi.append([0,0,0,0,0,0,0,0])
-    return midi
+        out[len(midi)-1] = 0
+        out[len(midi)-1, 0] = _note_to_midi(last) + 48
+    return out
 
 #Shuffle Dataset ----------------------------------------------------------------
 
 #create a file with shuffled reference index
 def createWindowedShuffleReference(size, window, save = False):
-    s = np.arange(0, size, 1)
-    #num = np.arange(0, len(data)/10, 1)
-    np.random.shuffle(s)
-
     n = int(size/window)
     numlist = random.sample(range(n), n)
     numlist = np.array(numlist)
@@ -410,12 +463,8 @@ def createWindowedShuffleReference(size, window, save = False):
         rest = m - l_ref
         numlist = numlist - rest
 
-    ref = []
-    for num in numlist:
-        if num == 0:
-            print("OK")
-        for i in range(0,window):
-            ref.append(num+i)
+    #every shuffled window start expands to its window of consecutive indices
+    ref = (numlist[:, None] + np.arange(window, dtype=numlist.dtype)).ravel()
 
     #return the shuffled list
     if save:
@@ -434,6 +483,11 @@ def generateDatasetSplit(db, split=0.1):
 #Save sessions ----------------------------------------------------------------
 import copy
 import json
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
 MODEL_NAME = "session_model"
 
 def save_metadata_to_json(metadata, output_dir="../dataset/metadata"):
@@ -452,18 +506,31 @@ def save_metadata_to_json(metadata, output_dir="../dataset/metadata"):
     
     json_path = os.path.join(output_dir, f"{safe_filename}.json")
     
-    with open(json_path, 'w', encoding='utf-8') as f:
-        json.dump(metadata, f, indent=2, ensure_ascii=False)
+    if HAS_ORJSON:
+        with open(json_path, 'wb') as f:
+            f.write(orjson.dumps(metadata, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+    else:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(metadata, f, indent=2, ensure_ascii=False)
     
     return json_path
 
-def export_all_metadata_from_xml(xml_dir="../dataset/iRealXML", output_dir="../dataset/metadata"):
+def _read_metadata(xml_path):
+    #worker side of export_all_metadata_from_xml: errors are returned, not raised,
+    #so one broken song does not abort the whole pool
+    try:
+        return get_metadata(xml_path), None
+    except Exception as e:
+        return None, e
+
+def export_all_metadata_from_xml(xml_dir="../dataset/iRealXML", output_dir="../dataset/metadata", workers=None):
     """
     Export metadata from all XML files as individual JSON files.
     
     Args:
         xml_dir: Directory containing XML files
         output_dir: Directory to save JSON files
+        workers: Number of parsing processes (defaults to the CPU count)
         
     Returns:
         List of exported JSON file paths
@@ -471,15 +538,21 @@ def export_all_metadata_from_xml(xml_dir="../dataset/iRealXML", output_dir="../d
     os.makedirs(output_dir, exist_ok=True)
     exported_files = []
     
-    xml_files = [f for f in os.listdir(xml_dir) if f.endswith('.xml')]
+    with os.scandir(xml_dir) as entries:
+        xml_entries = [e for e in entries if e.name.endswith('.xml')]
+    xml_files = [e.name for e in xml_entries]
+    xml_paths = [e.path for e in xml_entries]
     
     print(f"Exporting metadata for {len(xml_files)} songs...")
     
-    for xml_file in tqdm(xml_files):
-        xml_path = os.path.join(xml_dir, xml_file)
-        
+    #the JSON files are written here, in listing order, so songs sharing a name
+    #resolve exactly as they did with the sequential loop
+    results = map_song_files(_read_metadata, xml_paths, workers)
+    for xml_file, (metadata, error) in zip(xml_files, tqdm(results, total=len(xml_paths))):
+        if error is not None:
+            print(f"Error processing {xml_file}: {error}")
+            continue
         try:
-            metadata = get_metadata(xml_path)
             json_path = save_metadata_to_json(metadata, output_dir)
             exported_files.append(json_path)
         except Exception as e:
@@ -559,11 +632,10 @@ class MPE_MIDI_Exporter:
         
         Args:
             midi_voicing_data: List of 3-tuples [(midi_notes_array, duration, chord_name), ...]
+                or the voicing.VoicingOutput columns returned by convert_chords_to_voicing()
             filename: Output filename
             output_path: Directory to save file
         """
-        import random
-        
         # Create MIDI file with 1 track
         midi = MIDIFile(1, adjust_origin=False)
         track = 0
@@ -574,39 +646,25 @@ class MPE_MIDI_Exporter:
         # Setup MPE channels
         self.setup_mpe_channels(midi)
         
-        # Export all chords directly - no complex filtering needed!
-        current_time = 0.0
+        # Build the whole note schedule first (see voicing.chord_note_schedule)
+        pitches, start_beats, duration_beats = chord_note_schedule(midi_voicing_data, tempo)
+        
+        # Each note gets its own MPE channel (round-robin, continuing from the last export)
+        total_notes = len(pitches)
+        channel_idx = (self.current_channel_idx + np.arange(total_notes)) % len(self.note_channels)
+        channels = np.asarray(self.note_channels)[channel_idx]
+        self.current_channel_idx = (self.current_channel_idx + total_notes) % len(self.note_channels)
+        velocities = np.random.uniform(55, 85, size=total_notes).astype(int)
         
-        for item in midi_voicing_data:
-            midi_notes = item[0]
-            duration = float(item[1])
-            
-            # Get non-zero notes
-            active_notes = [note for note in midi_notes if note > 0]
-            
-            # Skip if no notes
-            if len(active_notes) == 0:
-                continue
-            
-            # Convert duration from seconds to beats
-            # At 120 BPM: 1 second = 2 beats
-            duration_in_beats = duration * (tempo / 60.0)
-            
-            # Add each note to a separate MPE channel
-            for note in active_notes:
-                channel = self.get_next_channel()
-                velocity = int(random.uniform(55, 85))
-                
-                # Add note on MPE channel
-                midi.addNote(track=track, 
-                           channel=channel, 
-                           pitch=int(note), 
-                           time=current_time, 
-                           duration=duration_in_beats, 
-                           volume=velocity)
-            
-            # Advance time
-            current_time += duration_in_beats
+        for channel, pitch, time, duration, velocity in zip(channels.tolist(), pitches.tolist(),
+                                                           start_beats.tolist(),
+                                                           duration_beats.tolist(), velocities.tolist()):
+            midi.addNote(track=track, 
+                       channel=channel, 
+                       pitch=pitch, 
+                       time=time, 
+                       duration=duration, 
+                       volume=velocity)
         
         # Write MIDI file
         full_path = f"{output_path}/{filename}.mid"
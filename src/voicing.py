@@ -13,43 +13,468 @@
 #    - get_drop_2_voicing() and get_drop_3_voicing(): Create jazz-style drop voicings
 # 4. Function-based voicing selection inspired by modal harmony principles
 #
-from midiutil import MIDIFile
-import tqdm as tqdm
-import random
 import numpy as np
 import pytz
-from datetime import datetime, timezone
-from music21 import midi, environment, stream
+from datetime import datetime
 import os
+import sys
+from itertools import chain
+from bisect import insort
+from concurrent.futures import ThreadPoolExecutor
 import mido
-from mido import MidiFile, MidiTrack, Message
+from mido import MidiFile, MidiTrack, Message, MetaMessage
+
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+VOICING_PAD = -128 #empty slot in Voicing.voicing_tbl
+MAX_DIST = 1 << 14 #int sentinel above any distance between MIDI notes
+STOCKHOLM_TZ = pytz.timezone('Europe/Stockholm') #timestamp prefix of the MidiChord files
+_IO_POOL = ThreadPoolExecutor(max_workers=1) #writes MidiChord files in the background, in call order
+
+#Token categories used by get_midi (Voicing._token_info maps token -> (category, payload));
+#the inert ones (bar lines, form markers, unknown tokens) come last
+CAT_DOT, CAT_DURATION, CAT_NOTE, CAT_NATURE, CAT_ADD, CAT_ALTER, CAT_SLASH, CAT_STRUCT, CAT_OTHER = range(9)
+TOKEN_OTHER = (CAT_OTHER, 0)
+
+#Offsets of the add tokens and the altered interval of the alter tokens (shared by every Voicing)
+ADD_DICT = {
+    'add b13': 8 + 12,
+    'add 13': 9 + 12,
+    'add #11': 6 + 12,
+    'add 11': 6 + 11,
+    'add #9': 3 + 12,
+    'add 9': 2 + 12,
+    'add b9': 1 + 12,
+    'add 8': 12,
+    'add 7': 11,
+    'add #7': 11,
+    'add 6': 9,
+    'add b6': 8 + 12,
+    'add 5': 7,
+    'add b5': 6,
+    'add 2': 2 + 12,
+    'add b2': 1
+}
+ALTER_DICT = {
+    'alter b9': 2,
+    'alter #9': 2,
+    'alter b5': 7,
+    'alter #5': 7,
+    'alter #7': 11,
+    'alter #11': 5
+}
+#semitone the alteration moves the note by (flat -1, sharp +1)
+ALTER_SIGN = {t: -1 if 'b' in t else 1 for t in ALTER_DICT}
+
+#Color tones added by add_extensions_for_quality: chord type -> (interval, voicing size gate)
+#pairs in the order they are tried (9th, 11th, 13th)
+QUALITY_EXTENSIONS = {
+    'maj7': ((14, 6), (21, 7)),
+    'm7': ((14, 6),),
+    'dom7': ((14, 6), (21, 7)),
+    'sus7': ((14, 6), (17, 6)),
+    'sus4': ((17, 6),),
+    'm_maj7': ((14, 6),),
+}
+
+#Low interval limits of a voicing: LIL_OK[n1 - 21, interval] for an adjacent pair with the
+#lower note n1 on the piano (21..108). No intervals < 5 semitones below C3 (48), no intervals
+#< 3 semitones below E3 (52); unisons are always allowed
+_lil_n1 = np.arange(21, 109)[:, None]
+_lil_interval = np.arange(88)[None, :]
+LIL_OK = ~((_lil_interval > 0) & (((_lil_n1 < 48) & (_lil_interval < 5)) | ((_lil_n1 < 52) & (_lil_interval < 3))))
+del _lil_n1, _lil_interval
+
+#PITCH_CLASS_BITS[pc]: the _pitch_mask bits of every pitch of pitch class pc (pitch 0, an empty
+#slot, excluded), so "is this pitch class in the chord" is one and
+PITCH_CLASS_BITS = [sum(1 << n for n in range(pc or 12, 256, 12)) for pc in range(12)]
+
+def _pitch_mask(notes):
+    #bitmask of the pitches in notes (bit n for pitch n), so membership is one shift-and
+    mask = 0
+    for n in notes:
+        mask |= 1 << n
+    return mask
+
+def _is_spaced_extension(token):
+    #add/subtract/alter extensions are written with a leading space in a chord name
+    return 'add' in token or 'subtract' in token or 'alter' in token
+
+#-----------------------------------------------------------------------
+# Drop 2 / Drop 3 candidate kernels (plain NumPy, compiled with numba when available)
+def _valid_voicing(notes):
+    #check for muddiness and range of an ascending voicing (lowest and highest note are the ends)
+    if notes.shape[0] == 0:
+        return False
+    # Range check: Piano 21 to 108
+    if notes[0] < 21 or notes[-1] > 108:
+        return False
+    # Low interval limits, looked up per adjacent pair in LIL_OK
+    for i in range(notes.shape[0] - 1):
+        if not LIL_OK[notes[i] - 21, notes[i + 1] - notes[i]]:
+            return False
+    return True
+
+def _realize(root, upper, out, count):
+    #writes every valid [bass root] + upper structure realization of the sorted intervals
+    #upper into out[count:]; upper is only read, so callers can pass a reused scratch row
+    pc = root % 12
+    #center the upper structure around C4 (60), rounded to the nearest octave (half to even)
+    base_shift = int(60 - upper.mean())
+    q = base_shift // 12
+    r = base_shift - q * 12
+    if r > 6 or (r == 6 and q % 2 == 1):
+        q += 1
+    base_shift = q * 12
+    #everything below only moves by octaves, so the root's pitch class is added once
+    upper = upper + pc
+    for bass_oct in (36, 48): # C2, C3
+        actual_root = pc + bass_oct
+        if actual_root > 55: actual_root -= 12 # Keep bass low-ish
+        if actual_root < 36: actual_root += 12
+        for oct_shift in (base_shift - 12, base_shift, base_shift + 12):
+            # Upper structure shouldn't go below bass root
+            if upper[0] + oct_shift <= actual_root:
+                continue
+            #candidate goes straight into the next free row, kept only if it is valid; it is
+            #already ascending (bass below the sorted upper structure)
+            out[count, 0] = actual_root
+            out[count, 1:] = upper + oct_shift
+            if _valid_voicing(out[count]):
+                count += 1
+    return count
+
+def _voicing_candidates(root, inversions):
+    #drop 2 and drop 3 realizations of every (sorted) inversion of a closed stack
+    n_inv, k = inversions.shape
+    #at most 6 realizations per drop variant
+    out = np.empty((n_inv * 12, k + 1), np.int16)
+    count = 0
+    #one scratch row for every drop variant, re-sorted in place after the drop
+    d = np.empty(k, np.int16)
+    for i in range(n_inv):
+        # Drop 2: 2nd highest note an octave down
+        if k >= 2:
+            d[:] = inversions[i]
+            d[k - 2] -= 12
+            d.sort()
+            count = _realize(root, d, out, count)
+        # Drop 3: 3rd highest note an octave down
+        if k >= 3:
+            d[:] = inversions[i]
+            d[k - 3] -= 12
+            d.sort()
+            count = _realize(root, d, out, count)
+    return out[:count]
+
+def _fit_octaves(root, upper, prev_upper):
+    #octave search of optimize_voicing_octaves: every upper voice moves by the first of the ±2
+    #octave shifts that is valid and closest to a previous upper voice (to the root when there
+    #are none); a voice without a valid shift keeps its note. Returns the voices unsorted
+    out = upper.copy()
+    for v in range(upper.shape[0]):
+        best = MAX_DIST
+        for shift in (-24, -12, 0, 12, 24):
+            cand = upper[v] + shift
+            # Must be: in range, above root, in comfortable voicing range
+            if cand <= root or cand < 24 or cand > 96:
+                continue
+            # For 3rd and 7th (typically first two upper voices), prefer range C3-C5
+            if v <= 2 and (cand < 48 or cand > 72):
+                continue
+            if prev_upper.shape[0] > 0:
+                d = MAX_DIST
+                for p in prev_upper:
+                    d = min(d, abs(cand - p))
+            else:
+                d = abs(cand - root)
+            if d < best:
+                best = d
+                out[v] = cand
+    return out
+
+def _min_cost_match(dm):
+    #minimum total distance of a one-to-one matching of every next voice to a previous voice on
+    #a (next x prev) distance matrix (Hungarian method with potentials, O(n^2 m) for the 8x8 at
+    #most seen here); -1 when there are more next voices than previous ones
+    n_next, n_prev = dm.shape
+    if n_next > n_prev:
+        return -1
+    #1-based: row potentials u, column potentials v, p[j] = row matched to column j
+    u = np.zeros(n_next + 1, dtype=np.int64)
+    v = np.zeros(n_prev + 1, dtype=np.int64)
+    p = np.zeros(n_prev + 1, dtype=np.int64)
+    way = np.zeros(n_prev + 1, dtype=np.int64)
+    for i in range(1, n_next + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(n_prev + 1, MAX_DIST * MAX_DIST, dtype=np.int64)
+        used = np.zeros(n_prev + 1, dtype=np.bool_)
+        while True:
+            #grow the alternating tree from row i until it reaches a free column
+            used[j0] = True
+            i0 = p[j0]
+            delta = MAX_DIST * MAX_DIST
+            j1 = 0
+            for j in range(1, n_prev + 1):
+                if not used[j]:
+                    cur = dm[i0 - 1, j - 1] - u[i0] - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(n_prev + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        #flip the augmenting path
+        while j0 != 0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+    total = 0
+    for j in range(1, n_prev + 1):
+        if p[j] != 0:
+            total += dm[p[j] - 1, j - 1]
+    return total
+
+def _optimized_distance(sorted_prev, sorted_next):
+    #optimal voice leading distance between two pitch-sorted int64 voicings
+    return _min_cost_match(np.abs(sorted_next[:, None] - sorted_prev[None, :]))
+
+def _voice_leading_distance(prev, nxt):
+    #optimal voice leading distance where every next note may also move an octave down or up
+    diff = nxt[:, None] - prev[None, :]
+    return _min_cost_match(np.minimum(np.abs(diff), np.minimum(np.abs(diff - 12), np.abs(diff + 12))))
+
+def _best_row(sorted_prev, rows, lengths, drift_penalty):
+    #index of the candidate row (first lengths[k] slots, zeros ignored) with the lowest optimal
+    #voice leading distance from sorted_prev plus its drift penalty; 0 when none can be matched
+    best_k = 0
+    min_distance = np.inf
+    for k in range(rows.shape[0]):
+        # Filter out empty voicings
+        if lengths[k] == 0:
+            continue
+        row = rows[k, :lengths[k]]
+        sorted_next = np.sort(row[row != 0].astype(np.int64))
+        distance = _optimized_distance(sorted_prev, sorted_next) if sorted_next.shape[0] > 0 else 0
+        if distance < 0:
+            continue
+        total_score = distance + drift_penalty[k]
+        if total_score < min_distance:
+            min_distance = total_score
+            best_k = k
+    return best_k
+
+def _midi_rows(cats, payloads, aux, voicing_tbl, voicing_len, out):
+    #get_midi over pre-encoded tokens (category, payload, aux: the b9/#9 flag of an add, the
+    #direction of an alter) writing one row per token into out; returns the first token whose
+    #chord grew past 8 notes, or -1
+    midi = np.zeros(16, np.int64) #current chord, first n slots
+    tmp = np.zeros(16, np.int64)
+    n = 8
+    root = 0
+    for i in range(cats.shape[0]):
+        cat = cats[i]
+        p = payloads[i]
+        if cat == CAT_DOT:
+            midi[:8] = 0
+            n = 8
+        elif cat == CAT_DURATION:
+            if n > 8:
+                return i
+            out[i, :n] = midi[:n]
+        elif cat == CAT_NOTE and cats[i - 1] != CAT_SLASH:
+            #(the token before the first one is the last one, as with sequence[i-1])
+            root = p
+            midi[:8] = 0
+            midi[0] = root
+            n = 8
+            out[i, 0] = root
+        elif cat == CAT_NATURE:
+            t = i % 3
+            n = int(voicing_len[p, t])
+            for j in range(n):
+                midi[j] = voicing_tbl[p, t, j] + root
+            out[i, :n] = midi[:n]
+        elif cat == CAT_ADD:
+            new_note = root + p
+            found = False
+            for j in range(n):
+                if midi[j] == new_note:
+                    found = True
+                    break
+            if not found:
+                midi[n] = new_note
+                n += 1
+            if aux[i]:
+                #add b9 / add #9: drop the natural 9th (or the one an octave up)
+                loc = -1
+                for target in (root + 14, root + 26):
+                    for j in range(n):
+                        if midi[j] == target:
+                            loc = j
+                            break
+                    if loc >= 0:
+                        break
+                if loc >= 0:
+                    midi[loc:n - 1] = midi[loc + 1:n].copy()
+                    n -= 1
+            if n > 8:
+                return i
+            out[i, :n] = midi[:n]
+        elif cat == CAT_ALTER:
+            #the altered chord is only written out, the current chord keeps its notes; a
+            #repeated pitch only moves its first occurrence
+            m = n
+            tmp[:n] = midi[:n]
+            found = False
+            for j in range(n):
+                x = midi[j]
+                if (x - root) % 12 == p:
+                    first = True
+                    for k in range(j):
+                        if midi[k] == x:
+                            first = False
+                            break
+                    if first:
+                        tmp[j] = x + aux[i]
+                        found = True
+            if not found:
+                tmp[m] = root + p + aux[i]
+                m += 1
+            if m > 8:
+                return i
+            out[i, :m] = tmp[:m]
+        elif cat == CAT_NOTE:
+            #a note right after '/': new bass, then the non-zero notes with the old root
+            #(first one) an octave up, padded to 8
+            m = 1
+            tmp[0] = p
+            for j in range(n):
+                if midi[j] > 0:
+                    tmp[m] = midi[j] + 12 if m == 1 else midi[j]
+                    m += 1
+            n = max(m, 8)
+            tmp[m:n] = 0
+            midi[:n] = tmp[:n]
+            if n > 8:
+                return i
+            out[i, :n] = midi[:n]
+    return -1
+
+if HAS_NUMBA:
+    _valid_voicing = njit(cache=True, nogil=True)(_valid_voicing)
+    _realize = njit(cache=True, nogil=True)(_realize)
+    _voicing_candidates = njit(cache=True, nogil=True)(_voicing_candidates)
+    _fit_octaves = njit(cache=True, nogil=True)(_fit_octaves)
+    _min_cost_match = njit(cache=True, nogil=True)(_min_cost_match)
+    _optimized_distance = njit(cache=True, nogil=True)(_optimized_distance)
+    _voice_leading_distance = njit(cache=True, nogil=True)(_voice_leading_distance)
+    _best_row = njit(cache=True, nogil=True)(_best_row)
+    _midi_rows = njit(cache=True, nogil=True)(_midi_rows)
+
+class VoicingOutput:
+    #convert_chords_to_voicing result as parallel columns: midi (n, 8) int16 rows, durations
+    #(n,) float64 and the n chord labels. Indexing and iterating still give the
+    #(midi list, duration, label) tuples of the list it replaces
+    def __init__(self, midi, durations, elements):
+        self.midi = midi
+        self.durations = durations
+        self.elements = elements
+    
+    def as_tuples(self):
+        return list(zip(self.midi.tolist(), self.durations.tolist(), self.elements))
+    
+    def __len__(self):
+        return len(self.elements)
+    
+    def __iter__(self):
+        return iter(self.as_tuples())
+    
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return VoicingOutput(self.midi[k], self.durations[k], self.elements[k])
+        return (self.midi[k].tolist(), float(self.durations[k]), self.elements[k])
+    
+    def __eq__(self, other):
+        if isinstance(other, VoicingOutput):
+            other = other.as_tuples()
+        return self.as_tuples() == other
+    
+    __hash__ = None
+    
+    def __repr__(self):
+        return f"VoicingOutput({self.as_tuples()!r})"
+
+def chord_note_schedule(sequence, tempo):
+    #note schedule shared by the MIDI exporters: one row per non-zero note, in chord order,
+    #as (pitches, start_beats, duration_beats). sequence is a VoicingOutput or a list of
+    #(midi_array, duration, label) items, durations in seconds; chords without notes are
+    #skipped and do not advance time
+    if isinstance(sequence, VoicingOutput):
+        # Already in columns
+        chord_notes, chord_secs = sequence.midi, sequence.durations
+    else:
+        chord_notes = np.array([item[0] for item in sequence]) if len(sequence) else np.zeros((0, 8))
+        chord_secs = np.array([float(item[1]) for item in sequence], dtype=float)
+    # Convert duration from seconds to beats
+    # At 120 BPM: 1 second = 2 beats
+    chord_beats = chord_secs * (tempo / 60.0)
+    active = chord_notes > 0
+    played = active.any(axis=1)
+    beats = chord_beats[played]
+    chord_start = np.concatenate(([0.0], np.cumsum(beats)[:-1]))
+    chord_idx, note_idx = np.nonzero(active[played])
+    pitches = chord_notes[played][chord_idx, note_idx].astype(np.int64)
+    return pitches, chord_start[chord_idx], beats[chord_idx]
 
 class Voicing:
     #define the class
-    def __init__(self):
+    def __init__(self, verbose=True):
+        
+        #print a line for every MIDI file written
+        self.verbose = verbose
         
         #define the natures of the chords
-        self.natures = {'maj', 'maj6', 'maj7', 'm', 'm6', 'm7', 'm_maj7', 'dom7', 'sus', 'sus2', 'sus7', 'sus4', 'o7', 'o', 'ø7', 'power', 'aug', 'o_maj7', 'N.C.'}
+        self.natures = frozenset({'maj', 'maj6', 'maj7', 'm', 'm6', 'm7', 'm_maj7', 'dom7', 'sus', 'sus2', 'sus7', 'sus4', 'o7', 'o', 'ø7', 'power', 'aug', 'o_maj7', 'N.C.'})
         
         #alterations and add
-        self.alter = {'add b2', 'add 2', 'add b5', 'add 5', 'add #5', 'add b6', 'add 6' 'add 7', 'add #7', 'add 8', 'add b9', 'add 9', 'add #9', 'add #11', 'add 13', 'add b13', 'alter #11', 'alter #5', 'alter #7', 'alter #9', 'alter b5', 'alter b9'}        
+        self.alter = frozenset({'add b2', 'add 2', 'add b5', 'add 5', 'add #5', 'add b6', 'add 6' 'add 7', 'add #7', 'add 8', 'add b9', 'add 9', 'add #9', 'add #11', 'add 13', 'add b13', 'alter #11', 'alter #5', 'alter #7', 'alter #9', 'alter b5', 'alter b9'})
         
         #Structural elements
-        self.structural_elements = {'.', '|', '||', ':|', '|:', 'b||', 'e||', '/'} #to add the maj token 
+        self.structural_elements = frozenset({'.', '|', '||', ':|', '|:', 'b||', 'e||', '/'}) #to add the maj token 
+        
+        #Section markers of the form; with the structural elements they close a bare root (add_maj_token)
+        self.form_tokens = frozenset({'Form_A', 'Form_B', 'Form_C', 'Form_D', 'Form_verse', 'Form_intro',
+                                      'Form_Coda', 'Form_Head', 'Form_Segno'})
+        self._maj_terminators = self.form_tokens | self.structural_elements
         
         #element in the chord frontiers
-        self.after_chords = {'.', '|', '||', ':|', '|:', 'b||', 'e||'} 
+        self.after_chords = frozenset({'.', '|', '||', ':|', '|:', 'b||', 'e||'})
         
         #Voicing - 7 different templates inspired by modal_studio_Chord.js
         # These correspond to different chord functions (I, II, III, IV, V, VI, VII)
         self.voicing = ['v_0', 'v_1', 'v_2', 'v_3', 'v_4', 'v_5', 'v_6']
         
         #Durations 
-        self.durations = {'0.3997395833333333', '0.4440104166666667', '0.5', '0.5703125',
+        self.durations = frozenset({'0.3997395833333333', '0.4440104166666667', '0.5', '0.5703125',
                 '0.6666666666666666', '0.75', '0.7994791666666666', '0.8880208333333334',
                 '1.0', '1.1419270833333333', '1.3333333333333333', '1.5',
                 '1.5989583333333333', '1.7135416666666667', '2.0', '2.25',
-                '2.3997395833333335', '2.6666666666666665', '3.0', '4.0'}
+                '2.3997395833333335', '2.6666666666666665', '3.0', '4.0'})
         
         #All notes
         self.all_notes = {
@@ -59,6 +484,10 @@ class Voicing:
             'F##': 55, 'F###': 56, 'Fbb': 51, 'G##': 45, 'Gbb': 41
             }
         
+        #interned names, so interned sequence tokens match on identity in every lookup
+        self.all_notes = {sys.intern(k): v for k, v in self.all_notes.items()}
+        self._notes_frozen = frozenset(self.all_notes)
+        
         # ----------------------------------------------------------------------
         # CLOSED POSITION STACKS (4-note blocks for Drop 2/3)
         # These are used to generate the Upper Structure
@@ -83,6 +512,18 @@ class Voicing:
             'power':    [0, 7, 12, 19],  # R 5 R 5
             'o_maj7':   [0, 3, 6, 11],   # R b3 b5 7
         }
+        #same stacks as an int8 table for the candidate kernel, the last row is the major default
+        self.stack_id = {nature: i for i, nature in enumerate(self.closed_stacks)}
+        self.default_stack_id = len(self.stack_id)
+        self.stack_tbl = np.array(list(self.closed_stacks.values()) + [[0, 4, 7, 12]], dtype=np.int8)
+        #inversion k is stack[k:] + (stack[:k] + 12), built by modulo indexing; only stacks wider
+        #than an octave (power) come out unsorted, so the table is sorted once here
+        rot = np.arange(4)[:, None] + np.arange(4)[None, :]
+        self.inversion_tbl = np.sort(self.stack_tbl[:, rot % 4] + 12 * (rot >= 4), axis=-1).astype(np.int8)
+        #generate_voicing_candidates tables keyed by (root % 12, nature): the candidates of every
+        #pitch class of every known nature are realized once here, other natures on first use
+        self._vc_cache = {(pc, nature): self._pack_candidates(_voicing_candidates(pc, self.inversion_tbl[sid]))
+                          for nature, sid in self.stack_id.items() for pc in range(12)}
 
         # Legacy Templates (kept for fallback or specific styles)
         # Major chord voicings (Root, 3, 5, 9)
@@ -268,11 +709,7 @@ class Voicing:
         }
         
         # No chord
-        self.noChord = {
-            'v_0': [0], 'v_1': [0], 'v_2': [0],
-            'v_3': [0], 'v_4': [0], 'v_5': [0],
-            'v_6': [0]
-        }
+        self.noChord = dict.fromkeys(self.voicing, (0,)) #one shared (read-only) silent template
                
         #TODO: define voicing for guitar
         
@@ -281,6 +718,62 @@ class Voicing:
                               'ø7': self.ø7, 'o7': self.o7, 'o': self.o, 'sus': self.sus, 'sus7': self.sus7, 
                               'sus2': self.sus2, 'sus4': self.sus4, 'm6': self.m6, 'power': self.power, 
                               'm_maj7': self.m_maj7, 'maj6': self.maj6, 'aug': self.aug, 'o_maj7': self.o_maj7, 'N.C.': self.noChord}
+        
+        #Same templates as one padded int8 table: voicing_tbl[nature_id, voicing_id, slot],
+        #empty slots hold VOICING_PAD and voicing_len gives the template length
+        self.nature_to_id = {nature: nid for nid, nature in enumerate(self.chord_voicing)}
+        self.voicing_tbl = np.full((len(self.chord_voicing), len(self.voicing), 8), VOICING_PAD, dtype=np.int8)
+        self.voicing_len = np.zeros((len(self.chord_voicing), len(self.voicing)), dtype=np.int8)
+        for nature, nid in self.nature_to_id.items():
+            for vid, v in enumerate(self.voicing):
+                template = self.chord_voicing[nature][v]
+                self.voicing_tbl[nid, vid, :len(template)] = template
+                self.voicing_len[nid, vid] = len(template)
+        
+        #Offsets of the add tokens, altered interval and direction of the alter tokens
+        self.add_dict = ADD_DICT
+        self.alter_dict = ALTER_DICT
+        self.alter_sign = ALTER_SIGN
+        
+        #token -> (category, payload), filled lowest priority first so that a token in several
+        #sets keeps the category get_midi used to test first
+        self._token_info = {}
+        self._token_info.update((t, (CAT_STRUCT, 0)) for t in self.structural_elements)
+        self._token_info.update((t, (CAT_ALTER, v)) for t, v in self.alter_dict.items())
+        self._token_info.update((t, (CAT_ADD, v)) for t, v in self.add_dict.items())
+        self._token_info.update((t, (CAT_NATURE, self.nature_to_id[t])) for t in self.natures)
+        self._token_info.update((t, (CAT_NOTE, v)) for t, v in self.all_notes.items())
+        self._token_info.update((t, (CAT_DURATION, float(t))) for t in self.durations)
+        self._token_info['/'] = (CAT_SLASH, 0)
+        self._token_info['.'] = (CAT_DOT, 0)
+        self._token_info = {sys.intern(t): v for t, v in self._token_info.items()}
+        
+        #get_midi's token encoding: token -> id into the parallel category / payload / aux
+        #arrays (aux: 1 for add b9 / add #9, the direction of an alter); id 0 is any other token
+        self._midi_token_id = {}
+        cats, payloads, aux = [CAT_OTHER], [0], [0]
+        for t, (cat, payload) in self._token_info.items():
+            self._midi_token_id[t] = len(cats)
+            cats.append(cat)
+            payloads.append(0 if cat == CAT_DURATION else payload)
+            aux.append(ALTER_SIGN[t] if cat == CAT_ALTER else int(t == 'add b9' or t == 'add #9'))
+        self._midi_cat = np.array(cats, dtype=np.int64)
+        self._midi_payload = np.array(payloads, dtype=np.int64)
+        self._midi_aux = np.array(aux, dtype=np.int64)
+        self._midi_encode_cache = {} #token tuple -> encoded arrays of a long song (bounded, see _encode_midi_tokens)
+        
+        #convertChordsFromOutput: tokens that close a chord, and tokens skipped outright
+        #(ignored elements other than the closers, plus durations)
+        self._convert_terminators = frozenset({'.', '|', ':|', '<end>'})
+        self._convert_skip = (frozenset(self.listToIgnore()) - self._convert_terminators) | self.durations
+        #token -> whether it is an add/subtract/alter extension (joined with a leading space);
+        #seeded with the known tokens, tokens outside the vocabulary are classified on first sight
+        self._convert_spaced = {t: _is_spaced_extension(t) for t in self._token_info}
+        
+        #pitch bend reset (0 cents) of every MIDI channel, shared by the MidiChord tracks
+        self._zero_pb = tuple(self.create_pitch_bend(0, c) for c in range(16))
+        self._pending_saves = [] #MidiChord writes still in flight (finished ones are dropped)
+        self._chord_mid = None #MidiChord's MidiFile, built on first use
     #-----------------------------------------------------------------------
     def listToIgnore(self):
         ignore_list = {'<start>', '<end>', '<pad>', '.', '|', '||', 'b||', 'e||', 'Repeat_0', 'Repeat_1', 'Repeat_2', 'Repeat_3', 'Intro', 
@@ -297,184 +790,68 @@ class Voicing:
     # Add the maj token
     def add_maj_token(self, sequence):
         new_sequence = []
+        notes = self._notes_frozen
+        terminators = self._maj_terminators
         for song in sequence:
             new_song = []
-            for i in range(len(song)):
-                element = song[i]
-                new_song.append(element)
-                if element in self.all_notes.keys() and (i == len(song) - 1 or song[i + 1] in self.structural_elements 
-                                                         or song[i + 1].startswith('Form_')) and song[i-1] != '/':
-                    new_song.append('maj')
+            if song:
+                #walk (previous, token, next) forward; the token before the first one is the
+                #last one (as song[i-1] was) and the last token has no next one
+                prev = song[-1]
+                for element, nxt in zip(song, chain(song[1:], (None,))):
+                    new_song.append(element)
+                    if element in notes and (nxt is None or nxt in terminators
+                                             or nxt.startswith('Form_')) and prev != '/':
+                        new_song.append('maj')
+                    prev = element
             new_sequence.append(new_song)
         
         return new_sequence
     #-----------------------------------------------------------------------
     # Add the voicing to the sequence
     def get_midi(self, sequence):
-        midi_sequence = []
-        root = 0
-        mod = 3
+        #one row per token written straight into the output; rows left at zero pad to 8
+        out = np.zeros((len(sequence), 8), dtype=np.int32)
         status = True
-        # Create a dictionary for the alter section
-        add_dict = {
-            'add b13': 8 + 12,
-            'add 13': 9 + 12, 
-            'add #11': 6 + 12,
-            'add 11': 6 + 11,
-            'add #9': 3 + 12,
-            'add 9': 2 + 12,
-            'add b9': 1 + 12,
-            'add 8': 12,
-            'add 7': 11,
-            'add #7': 11,
-            'add 6': 9,
-            'add b6': 8 + 12,
-            'add 5': 7,
-            'add b5': 6,
-            'add 2': 2 + 12,
-            'add b2': 1
-        }
-        # Create a dictionary for the alter section
-        alter_dict = {
-            'alter b9': 2,
-            'alter #9': 2,
-            'alter b5': 7,
-            'alter #5': 7,
-            'alter #7': 11,
-            'alter #11': 5
-        }
         
-        midi = [0, 0, 0, 0, 0, 0, 0, 0]
-        duration = 0.0
-        #check the chord info
-        for i, element in enumerate(sequence):
-            
-            #Check it is a dot ----------------------------------------------------
-            if element == '.':
-                #duration = float(sequence[i+1])
-                midi = [0, 0, 0, 0, 0, 0, 0, 0]
-                midi_sequence.append(midi)
-            #check the duration ----------------------------------------------------
-            elif element in self.durations:
-                duration = float(element)
-                midi_sequence.append(midi)
-            #check notes ------------------------------------------------------------
-            elif element in self.all_notes and sequence[i-1] != '/':
-                root = self.all_notes[element]
-                midi = [root, 0, 0, 0, 0, 0, 0, 0]
-              
-                midi_sequence.append(midi)
-                #print(element, sequence[i-1][0]) 
-            
-            # Nature section --------------------------------------------------------
-            elif element in self.natures:
-                n = i % mod
-                midi = [x + root for x in self.chord_voicing[element][self.voicing[n]]]
-                #print('chord:', element, midi)
-                infoMidi = midi.copy()
-                midi_sequence.append(infoMidi)
-            
-            # Add section --------------------------------------------------------      
-            elif element in add_dict:
-                #print('original', midi)
-                new_note = root + add_dict[element]
-                midiInfo = midi.copy()    
-                if new_note not in midiInfo:
-                    midiInfo.append(new_note)
-                      
-                if element == 'add b9' or element == 'add #9':
-                    #check if the 9 is in the chord
-                    if (root + 14) in midiInfo:
-                        index = midiInfo.index(root + 14)
-                        midiInfo.pop(index)
-                    elif (root + 26) in midiInfo:
-                        index = midiInfo.index(root + 26)
-                        midiInfo.pop(index)
-                        
-                midi_sequence.append(midiInfo)
-                midi = midiInfo
-                
-            # Alter section --------------------------------------------------------            
-            elif element in alter_dict:
-                #print('original', element, midi)
-                my_ref = [x for x in midi if (x - root) % 12 == alter_dict[element]]
-                midiInfo = midi.copy() 
-                
-                if len(my_ref) == 1:
-                    loc = midi.index(my_ref[0])
-                    if element.find('b') != -1:
-                        midiInfo[loc] = my_ref[0] - 1
-                    elif element.find('#') != -1:
-                        midiInfo[loc] = my_ref[0] + 1
-                        
-                elif len(my_ref) > 1:
-                    for i, n in enumerate(my_ref):
-                        loc = midi.index(n)
-                        if element.find('b') != -1 and (n - root) % 12 == alter_dict[element]:
-                            midiInfo[loc] = n - 1
-                        elif element.find('#') != -1 and (n - root) % 12 == alter_dict[element]:
-                            midiInfo[loc] = n + 1 
-                
-                elif len(my_ref) == 0:
-                    new_note = root + alter_dict[element]
-                    if element.find('b') != -1:
-                        new_note -= 1
-                    elif element.find('#') != -1:
-                        new_note += 1
-                    midiInfo.append(new_note)
-                    
-                midi_sequence.append(midiInfo)
-                #print('result', element, midi)
-                
-            # Slash section --------------------------------------------------------    
-            elif element == '/':
-                # Keep sequences aligned - append marker but don't affect voicing
-                # The actual slash bass note will be in the next element
-                thisMidi = [0, 0, 0, 0, 0, 0, 0, 0]
-                midi_sequence.append(thisMidi)
-                
-            # New root after slash section -----------------------------------------  
-            elif sequence[i-1][0] == '/' and element in self.all_notes:
-                # Slash chord: Take the current chord voicing, move old root up octave, add new bass
-                # Example: G7/D → G7 chord [43,65,71] becomes [50,55,65,71] (D bass, G+octave, B, F)
-                slash_bass = self.all_notes[element]
-                
-                # Start with current chord voicing
-                midiInfo = [x for x in midi if x > 0]  # Get only non-zero notes
-                
-                # Find the old root (lowest note in current voicing) and move it up one octave
-                if len(midiInfo) > 0:
-                    old_root = midiInfo[0]  # Lowest note is usually the root
-                    midiInfo[0] = old_root + 12  # Move up one octave
-                
-                # Insert the new bass note at the beginning
-                midiInfo.insert(0, slash_bass)
-                
-                # Pad to 8 notes
-                while len(midiInfo) < 8:
-                    midiInfo.append(0)
-                
-                midi_sequence.append(midiInfo)
-                midi = midiInfo  # Update midi so subsequent operations use slashed chord
-            
-            # Structural elements section ---------------------------------------------
-            elif element in self.structural_elements and element != '/':
-                thisMidi = [0, 0, 0, 0, 0, 0, 0, 0]
-                midi_sequence.append(thisMidi)
-                
-            # Form section -------------------------------------------------------------
-            elif element not in self.all_notes and element not in self.natures and element not in self.structural_elements and element not in self.durations:
-                thisMidi = [0, 0, 0, 0, 0, 0, 0, 0]
-                midi_sequence.append(thisMidi)
+        #encode the tokens once, then run the whole chord walk in _midi_rows
+        cats, payloads, aux = self._encode_midi_tokens(sequence)
+        bad = _midi_rows(cats, payloads, aux, self.voicing_tbl, self.voicing_len, out)
+        if bad >= 0:
+            raise ValueError(f"chord at token {bad} ({sequence[bad]!r}) has more than 8 notes")
         
-            
-        #Normalize the length of the MIDI sequence to 8 ----------------------------
-        for i, item in enumerate(midi_sequence):    
-            if len(item) < 8:
-                for i in range(8 - len(item)):
-                    item.append(0)
-        midi_sequence = np.array(midi_sequence, dtype=int)
-        return midi_sequence, status
+        return out, status
+    
+    def render_dataset(self, songs, workers=None, midi=False):
+        #convert_chords_to_voicing (or get_midi with midi=True) over many songs on a thread
+        #pool; the compiled kernels release the GIL, so songs overlap while they run. Results
+        #come back in the order of songs
+        render = self.get_midi if midi else self.convert_chords_to_voicing
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers < 2 or len(songs) < 2:
+            return [render(song) for song in songs]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(render, songs))
+    
+    def _encode_midi_tokens(self, sequence):
+        #get_midi's token arrays: category, payload (pitch, nature id, add offset, alter
+        #interval) and aux, one dict probe per token. Songs longer than 64 tokens are kept by
+        #content (hashing the tuple reuses the cached string hashes), so re-rendering a song
+        #skips the encoding; the arrays are only read
+        key = None
+        if len(sequence) > 64:
+            key = tuple(sequence)
+            encoded = self._midi_encode_cache.get(key)
+            if encoded is not None:
+                return encoded
+        ids = np.fromiter((self._midi_token_id.get(t, 0) for t in sequence), np.int64, len(sequence))
+        encoded = (self._midi_cat[ids], self._midi_payload[ids], self._midi_aux[ids])
+        if key is not None:
+            if len(self._midi_encode_cache) >= 1024:
+                self._midi_encode_cache.clear()
+            self._midi_encode_cache[key] = encoded
+        return encoded
     
     def generate_voicing_candidates(self, root, nature):
         """
@@ -488,378 +865,244 @@ class Voicing:
            - Apply Drop 2: Drop 2nd note from top an octave down (usually ends up between LH and RH).
            - Apply Drop 3: Drop 3rd note from top an octave down.
         """
-        candidates = []
-        
-        # 1. Determine Closed Stack relative to root=0
         if nature == 'N.C.':
             return []
-            
-        stack = self.closed_stacks.get(nature, [0, 4, 7, 12]) # Default to Major Add Octave
-        
-        # 2. Generate Inversions of the Closed Stack (still relative to 0)
-        # stack is e.g. [0, 4, 7, 12]
-        # inv0: [0, 4, 7, 12]
-        # inv1: [4, 7, 12, 12] -> [4, 7, 12, 12] normalized?
-        # Better: Invert by taking bottom note + 12.
-        
-        base_stack = sorted(stack)
-        inversions = []
-        
-        # Create 4 inversions
-        current = list(base_stack)
-        for _ in range(4):
-            inversions.append(sorted(current))
-            # Invert: remove bottom, add it +12
-            bottom = current[0]
-            current = current[1:] + [bottom + 12]
-            current = sorted(current)
-            
-        # 3. For each inversion, generate Closed, Drop 2, Drop 3
-        # And transpose to valid registers
-        
-        # Target Range for Upper Structure (before drop):
-        # We want the resulting CHORD to sit nicely.
-        # Usually checking Result range is better.
-        
-        for inv in inversions:
-            # inv is relative to 0. e.g. [0, 4, 7, 12]
-            
-            # --- Type A: Closed (Reference, maybe useful) ---
-            # candidates.append(self._create_candidate(root, inv, 'Closed'))
-            
-            # --- Type B: Drop 2 ---
-            # Drop 2nd highest note octave down
-            if len(inv) >= 2:
-                d2 = list(inv)
-                d2[-2] -= 12
-                candidates.extend(self._create_realizations(root, d2, nature))
+        rows, lengths, _ = self._candidate_table(root, nature)
+        return [row[:n] for row, n in zip(rows.tolist(), lengths.tolist())]
 
-            # --- Type C: Drop 3 ---
-            # Drop 3rd highest note octave down
-            if len(inv) >= 3:
-                d3 = list(inv)
-                d3[-3] -= 12
-                candidates.extend(self._create_realizations(root, d3, nature))
-                
+    def _candidate_table(self, root, nature):
+        #generate_voicing_candidates as a zero padded (K, 8) int8 table plus the length and
+        #mean pitch of every row, so select_best_voicing can score them without lists
+        if nature == 'N.C.':
+            return np.zeros((0, 8), np.int8), np.zeros(0, np.int64), np.zeros(0)
+        #the realizations only depend on the pitch class of the root (the bass is always
+        #placed in C2-C3), so they are computed once per (pitch class, nature)
+        key = (int(root) % 12, nature)
+        table = self._vc_cache.get(key)
+        if table is None:
+            # Default to Major Add Octave
+            stack_id = self.stack_id.get(nature, self.default_stack_id)
+            table = self._pack_candidates(_voicing_candidates(key[0], self.inversion_tbl[stack_id]))
+            self._vc_cache[key] = table
         # If no candidates found (e.g. strict range checks failed), fallback to simple
-        if not candidates:
-             return [[root, root+4, root+7, root+12]]
-             
-        return candidates
+        if table[0].shape[0] == 0:
+            return self._pack_candidates(np.array([[root, root+4, root+7, root+12]]))
+        return table
+
+    def _pack_candidates(self, candidates):
+        #(K, w) candidate array -> zero padded (K, 8) int8 rows, row lengths and mean pitches
+        k, width = candidates.shape
+        rows = np.zeros((k, 8), np.int8)
+        rows[:, :width] = candidates
+        lengths = np.full(k, width, dtype=np.int64)
+        means = candidates.sum(axis=1, dtype=np.int64) / max(width, 1)
+        return rows, lengths, means
 
     def _create_realizations(self, root, intervals, nature):
         """
         Create concrete MIDI voicings from relative intervals (Drop applied)
         by trying different octaves.
         
-        intervals: relative intervals (e.g. [-5, 0, 4, 11])
+        intervals: relative intervals (e.g. [-5, 0, 4, 11]), list or np.ndarray
         """
-        out = []
-        sorted_intervals = sorted(intervals)
-        
-        # Try centering the voicing
-        # Base Root usually C2(36) or C3(48). 
-        # Left Hand usually plays Root at C2 or C3.
-        
-        # We assume 'intervals' captures the relative shape of the RH + Dropped Note.
-        # But we MUST ADD The LEft Hand Root explicitly if it's not covered?
-        # The user says: "Root is on the left hand... Then the triad [dropped] is on the right"
-        # The dropped note falls "in between".
-        
-        # So structure: [BassRoot] + [UpperStructure (with Drop applied)]
-        
-        # Iterate possible root octaves for the Left Hand
-        for bass_oct in [36, 48]: # C2, C3
-            actual_root = root % 12 + bass_oct # e.g. 50 (D3) or 38 (D2)
-            if actual_root > 55: actual_root -= 12 # Keep bass low-ish
-            if actual_root < 36: actual_root += 12
-            
-            # Now place the Upper Structure
-            # We want the Upper Structure to be "above" the bass, or "wrapping" it?
-            # Usually above.
-            # The intervals are relative to 0.
-            # We need to shift them so they sit in the middle register (C3-C5).
-            
-            # Find loop of transpositions for the upper structure
-            # e.g. center around C4 (60)
-            
-            # Get centroid of intervals
-            avg_int = sum(sorted_intervals)/len(sorted_intervals)
-            
-            # We want avg_val + shift ~ 60
-            # shift ~ 60 - avg_int
-            
-            base_shift = int(60 - avg_int)
-            # Round to nearest octave (12)
-            base_shift = round(base_shift / 12) * 12
-            
-            # Try a few shifts around there
-            for oct_shift in [base_shift - 12, base_shift, base_shift + 12]:
-                
-                # Apply shift to upper structure
-                upper_notes = [n + oct_shift for n in sorted_intervals] # Absolute MIDI notes now?
-                # Wait, intervals were relative to 0. 
-                # If we add oct_shift (e.g. 60), we treat key of C=0.
-                # But we are in key of Root.
-                # So we need to add Root%12 too? 
-                # Yes. intervals are relative to Root.
-                
-                # Real notes = Root + Interval + OctaveShift
-                # But wait, logic above: "intervals" are relative to local 0.
-                
-                real_upper = [root % 12 + n + oct_shift for n in sorted_intervals]
-                
-                # Combine Bass + Upper
-                # Bass = actual_root
-                
-                # Check for clash: if lowest upper note is below bass?
-                min_upper = min(real_upper)
-                if min_upper <= actual_root:
-                    continue # Upper structure shouldn't go below bass root usually
-                    
-                # Create voicing
-                voicing = [actual_root] + real_upper
-                
-                if self.is_valid_voicing(voicing):
-                    out.append(voicing)
-                    
-        return out
+        intervals = np.sort(np.asarray(intervals, dtype=np.int16))
+        out = np.empty((6, intervals.shape[0] + 1), np.int16)
+        count = _realize(int(root), intervals, out, 0)
+        return out[:count].tolist()
 
     def is_valid_voicing(self, voicing):
         """Check for muddiness and range"""
-        if not voicing: return False
-        
-        # Range check: Piano 21 to 108
-        if min(voicing) < 21 or max(voicing) > 108:
-            return False
-            
-        # Low Interval Limit (roughly)
-        # No intervals < 3 semitones below E3 (52)
-        # No intervals < 5 semitones below C3 (48)
-        
-        notes = sorted(voicing)
-        for i in range(len(notes)-1):
-            n1 = notes[i]
-            n2 = notes[i+1]
-            interval = n2 - n1
-            
-            if interval == 0: continue # Unison is okay? Maybe avoid doubling thirds.
-            
-            if n1 < 48 and interval < 5: # Below C3, no thirds/seconds
-               return False
-            if n1 < 52 and interval < 3: # Below E3, no seconds
-               return False
-               
-        return True
+        return bool(_valid_voicing(np.sort(np.asarray(voicing, dtype=np.int16))))
 
     #-----------------------------------------------------------------------
     # Add the voicing to the sequence
     # DOT (.) = START of chord. Everything until next DOT is ONE chord.
     # Structure: . duration root nature [extensions] [/ bass]
     def convert_chords_to_voicing(self, sequence):
-        midi_sequence = []
-        mod = 7
+        # Output columns: 8-byte chord rows, durations and chord labels (see VoicingOutput)
+        chord_rows = []
+        chord_durations = []
+        chord_labels = []
         status = True
         previous_voicing = None
         
-        add_dict = {
-            'add b13': 8 + 12, 'add 13': 9 + 12, 'add #11': 6 + 12, 'add 11': 6 + 11,
-            'add #9': 3 + 12, 'add 9': 2 + 12, 'add b9': 1 + 12, 'add 8': 12,
-            'add 7': 11, 'add #7': 11, 'add 6': 9, 'add b6': 8 + 12,
-            'add 5': 7, 'add b5': 6, 'add 2': 2 + 12, 'add b2': 1
-        }
-        alter_dict = {
-            'alter b9': 2, 'alter #9': 2, 'alter b5': 7,
-            'alter #5': 7, 'alter #7': 11, 'alter #11': 5
-        }
-        
-        # Find all DOT positions - each DOT starts exactly ONE chord
-        dot_positions = [i for i, elem in enumerate(sequence) if elem == '.']
+        # Local aliases for the per-token loop
+        token_info = self._token_info
+        candidate_table = self._candidate_table
+        best_candidate = self._best_candidate
         
-        for dot_idx, dot_pos in enumerate(dot_positions):
-            # Find the END of this chord (next DOT or end of sequence)
-            if dot_idx + 1 < len(dot_positions):
-                end_pos = dot_positions[dot_idx + 1]
-            else:
-                end_pos = len(sequence)
-            
-            # Extract chord tokens between this DOT and next DOT
-            chord_tokens = sequence[dot_pos:end_pos]
-            
-            # Parse this ONE chord
-            duration = 0.0
-            root = 0
-            midi = [0, 0, 0, 0, 0, 0, 0, 0]
-            chord_label = ''
-            has_slash = False
-            slash_bass = None
-            
-            for j, token in enumerate(chord_tokens):
-                if token == '.':
-                    continue
-                    
-                elif token in self.durations:
-                    duration = float(token)
-                    
-                elif token in self.all_notes and (j == 0 or chord_tokens[j-1] != '/'):
-                    # This is the ROOT note (not slash bass)
-                    root = self.all_notes[token]
-                    midi = [root, 0, 0, 0, 0, 0, 0, 0]
-                    chord_label = token
-                    
-                elif token in self.natures:
-                    # Get all possible voicing candidates (Closed, Drop 2, Drop 3 at various octaves)
-                    all_voicings = self.generate_voicing_candidates(root, token)
-                    
-                    if previous_voicing is not None:
-                        # Select the one that connects smoothest to previous chord
-                        midi = self.select_best_voicing(previous_voicing, all_voicings, prev_root=None, curr_root=root)
-                    else:
-                        # First chord: Pick a candidate in the middle register
-                        # Bias towards C3/C4 for root
-                        def root_clarity(v):
-                            if not v: return 100
-                            # Root is usually the lowest note here
-                            return abs(v[0] - 48) # Distance from C3
-                            
-                        midi = min(all_voicings, key=root_clarity) if all_voicings else [root, root+4, root+7]
-                    
-                    chord_label = token
-                    
-                elif token in add_dict:
-                    new_note = root + add_dict[token]
-                    if new_note not in midi:
-                        filled = False
-                        for idx in range(len(midi)):
-                            if midi[idx] == 0:
-                                midi[idx] = new_note
-                                filled = True
-                                break
-                        if not filled:
-                            midi.append(new_note)
-                    if token == 'add b9' or token == 'add #9':
-                        if (root + 14) in midi:
-                            midi[midi.index(root + 14)] = 0
-                        elif (root + 26) in midi:
-                            midi[midi.index(root + 26)] = 0
-                            
-                elif token in alter_dict:
-                    my_ref = [x for x in midi if x > 0 and (x - root) % 12 == alter_dict[token]]
-                    if len(my_ref) >= 1:
-                        for n in my_ref:
-                            loc = midi.index(n)
-                            if 'b' in token:
-                                midi[loc] = n - 1
-                            elif '#' in token:
-                                midi[loc] = n + 1
-                    elif len(my_ref) == 0:
-                        new_note = root + alter_dict[token]
-                        if 'b' in token:
-                            new_note -= 1
-                        elif '#' in token:
-                            new_note += 1
-                        filled = False
-                        for idx in range(len(midi)):
-                            if midi[idx] == 0:
-                                midi[idx] = new_note
-                                filled = True
-                                break
-                        if not filled:
-                            midi.append(new_note)
-                                
-                elif token == '/':
-                    has_slash = True
-                    
-                elif has_slash and token in self.all_notes:
-                    # Slash bass note - modify the chord
-                    # Get the bass note pitch class
-                    bass_pitch_class = self.all_notes[token] % 12
+        # Single pass: each DOT starts exactly ONE chord, which runs until the next DOT;
+        # a trailing DOT sentinel closes the last chord; the chord state is reset by every
+        # DOT and only read once in_chord is set
+        in_chord = False
+        duration = 0.0
+        midi = bytearray(8)
+        midi_mask = 1
+        chord_label = ''
+        for i, token in enumerate(chain(sequence, ('.',))):
+            # One probe per token: category code + payload (pitch, duration, add offset, alter interval)
+            cat, payload = token_info.get(token, TOKEN_OTHER)
+            if cat == CAT_DOT:
+                # A DOT closes the chord in progress and starts the next one
+                if in_chord:
+                    # Append exactly ONE chord for the previous DOT
+                    # Pad midi to 8 if needed
+                    if len(midi) < 8:
+                        midi.extend(bytes(8 - len(midi)))
                     
-                    # SMOOTH VOICE LEADING: Find optimal octave for slash bass
-                    # Start with octave 2 as default
-                    slash_bass = 36 + bass_pitch_class
+                    # Only append if we have actual notes
+                    notes = [n for n in midi[:8] if n]
+                    if notes:
+                        chord_rows.append(bytes(midi[:8]))
+                        chord_durations.append(duration)
+                        chord_labels.append(chord_label)
+                        previous_voicing = notes
+                
+                # Parse this ONE chord
+                in_chord = True
+                duration = 0.0
+                root = 0
+                midi = bytearray(8) # pitches fit in a byte, slots mutate in place
+                midi_mask = 1 # bit n set when pitch n is in midi (see _pitch_mask)
+                chord_label = ''
+                slash_at = -2
+                slash_bass = None
+                
+            elif not in_chord or cat >= CAT_STRUCT:
+                # Tokens before the first DOT don't belong to any chord, and bar lines / form
+                # markers / unknown tokens never touch it: skip them before the branch chain
+                continue
+                
+            elif cat == CAT_DURATION:
+                duration = payload
+                
+            elif cat == CAT_NOTE and slash_at == i - 1:
+                # Slash bass note (the note right after '/') - modify the chord
+                # Get the bass note pitch class
+                bass_pitch_class = payload % 12
+                
+                # SMOOTH VOICE LEADING: Find optimal octave for slash bass
+                # Start with octave 2 as default
+                slash_bass = 36 + bass_pitch_class
+                
+                # If we have a previous voicing, find closest octave
+                if previous_voicing:
+                    prev_bass = previous_voicing[0]  # Previous bass note
                     
-                    # If we have a previous voicing, find closest octave
-                    if previous_voicing:
-                        prev_bass = previous_voicing[0]  # Previous bass note
+                    # Closest octave to the previous bass (the lower one on a tie), kept in the
+                    # reasonable bass range: of octaves 1-4 only 2-4 land in 24-60
+                    octave = (prev_bass - bass_pitch_class + 5) // 12
+                    slash_bass = 12 * min(4, max(2, octave)) + bass_pitch_class
+                
+                # Get non-zero notes from current voicing, in the same pass removing any note
+                # with same pitch class as new bass (to avoid duplicates)
+                bass_pitch = slash_bass % 12
+                notes = [x for x in midi if x and x % 12 != bass_pitch]
+                
+                if notes:
+                    # Ensure all remaining notes are ABOVE the bass AND respect low interval limits
+                    adjusted_notes = []
+                    in_order = True
+                    for n in notes:
+                        # 1. Must be above bass: the fewest octaves that lift n past it
+                        if n <= slash_bass:
+                            n += 12 * ((slash_bass - n) // 12 + 1)
                         
-                        # Try different octaves and pick the closest to previous bass
-                        best_distance = float('inf')
-                        best_octave_bass = slash_bass
+                        # 2. Low interval limit check (avoid muddy minor 2nds/Major 2nds deep in bass)
+                        # If interval to bass is small (< 5 semitones) and bass is low (< 55 / G3)
+                        # Shift up an octave
+                        if (n - slash_bass) < 5 and slash_bass < 55:
+                            n += 12
                         
-                        # Try octaves 1-4 (MIDI 24-71)
-                        for octave in range(1, 5):
-                            candidate_bass = 12 * octave + bass_pitch_class
-                            distance = abs(candidate_bass - prev_bass)
-                            
-                            # Prefer smallest distance, but keep bass in reasonable range (24-60)
-                            if distance < best_distance and 24 <= candidate_bass <= 60:
-                                best_distance = distance
-                                best_octave_bass = candidate_bass
+                        # Octave shifts can break the ascending order of the voicing
+                        if adjusted_notes and adjusted_notes[-1] > n:
+                            in_order = False
+                        adjusted_notes.append(n)
                         
-                        slash_bass = best_octave_bass
-                    
-                    # Get non-zero notes from current voicing
-                    notes = [x for x in midi if x > 0]
-                    
-                    if len(notes) > 0:
-                        # Find the original root (by pitch class, not just lowest note)
-                        root_pitch_class = root % 12
-                        
-                        # Remove any note with same pitch class as new bass (to avoid duplicates)
-                        bass_pitch = slash_bass % 12
-                        notes = [x for x in notes if x % 12 != bass_pitch]
+                    # Sort (only when needed) and rebuild: bass first, then rest ascending
+                    if not in_order:
+                        adjusted_notes.sort()
+                    notes = [slash_bass] + adjusted_notes
+                else:
+                    notes = [slash_bass]
+                
+                # Rebuild midi array
+                midi = bytearray(notes)
+                if len(notes) < 8:
+                    midi.extend(bytes(8 - len(notes)))
+                midi_mask = _pitch_mask(midi)
+                chord_label = token  # Label is the bass note
+                
+            elif cat == CAT_NOTE:
+                # This is the ROOT note (not slash bass)
+                root = payload
+                midi = bytearray(8)
+                midi[0] = root
+                midi_mask = 1 | 1 << root
+                chord_label = token
+                
+            elif cat == CAT_NATURE:
+                # Get all possible voicing candidates (Closed, Drop 2, Drop 3 at various octaves)
+                rows, lengths, means = candidate_table(root, token)
+                
+                if previous_voicing is not None:
+                    # Select the one that connects smoothest to previous chord
+                    if rows.shape[0] > 0:
+                        k = best_candidate(previous_voicing, rows, lengths, means)
+                        midi = bytearray(rows[k, :lengths[k]].tobytes())
+                    else:
+                        midi = bytearray((0, 4, 7, 12))
+                else:
+                    # First chord: Pick a candidate in the middle register
+                    # Bias towards C3/C4 for root (the root is the lowest note here)
+                    if rows.shape[0] > 0:
+                        k = np.argmin(np.abs(rows[:, 0].astype(np.int16) - 48)) # Distance from C3
+                        midi = bytearray(rows[k, :lengths[k]].tobytes())
+                    else:
+                        midi = bytearray((root, root+4, root+7))
+                midi_mask = _pitch_mask(midi)
+                
+                chord_label = token
+                
+            elif cat == CAT_ADD:
+                new_note = root + payload
+                if not midi_mask >> new_note & 1:
+                    # First empty slot, or a new one
+                    if 0 in midi:
+                        midi[midi.index(0)] = new_note
+                    else:
+                        midi.append(new_note)
+                    midi_mask |= 1 << new_note
+                if token == 'add b9' or token == 'add #9':
+                    if midi_mask >> (root + 14) & 1:
+                        midi[midi.index(root + 14)] = 0
+                        midi_mask = _pitch_mask(midi)
+                    elif midi_mask >> (root + 26) & 1:
+                        midi[midi.index(root + 26)] = 0
+                        midi_mask = _pitch_mask(midi)
                         
-                        # Ensure all remaining notes are ABOVE the bass AND respect low interval limits
-                        adjusted_notes = []
-                        for n in notes:
-                            # 1. Must be above bass
-                            while n <= slash_bass:
-                                n += 12
-                            
-                            # 2. Low interval limit check (avoid muddy minor 2nds/Major 2nds deep in bass)
-                            # If interval to bass is small (< 5 semitones) and bass is low (< 55 / G3)
-                            # Shift up an octave
-                            if (n - slash_bass) < 5 and slash_bass < 55:
-                                n += 12
-                                
-                            adjusted_notes.append(n)
-                            
-                        # Sort and rebuild: bass first, then rest ascending
-                        adjusted_notes = sorted(adjusted_notes)
-                        notes = [slash_bass] + adjusted_notes
+            elif cat == CAT_ALTER:
+                step = ALTER_SIGN[token]
+                if midi_mask & PITCH_CLASS_BITS[(root + payload) % 12]:
+                    # The altered interval is in the chord: move every note on it
+                    for loc, x in enumerate(midi):
+                        if x and (x - root) % 12 == payload:
+                            midi[loc] += step
+                else:
+                    new_note = root + payload + step
+                    if 0 in midi:
+                        midi[midi.index(0)] = new_note
                     else:
-                        notes = [slash_bass]
-                    
-                    # Rebuild midi array
-                    midi = notes + [0] * (8 - len(notes))
-                    chord_label = token  # Label is the bass note
-            
-            # NOW append exactly ONE chord for this DOT
-            # Pad midi to 8 if needed
-            while len(midi) < 8:
-                midi.append(0)
-            midi = midi[:8]
-            
-            # Only append if we have actual notes
-            note_count = len([n for n in midi if n > 0])
-            if note_count > 0:
-                midi_sequence.append((midi.copy(), duration, chord_label))
-                previous_voicing = [n for n in midi if n > 0]
-        
-            
-        #Normalize the length of the MIDI sequence to 8 ----------------------------
-        for i, item in enumerate(midi_sequence):    
-            current_midi = item[0]
-            item_duration = item[1]  # Use the item's actual duration, not the loop variable!
-            element = item[2]
-            if len(current_midi) < 8:
-                for j in range(8 - len(current_midi)):
-                    current_midi.append(0)
-                # Update the item in the list with normalized MIDI
-                midi_sequence[i] = (current_midi, item_duration, element)
-     
-        return midi_sequence, status
+                        midi.append(new_note)
+                midi_mask = _pitch_mask(midi)
+                            
+            elif cat == CAT_SLASH:
+                # Position of the '/', so only the very next token is read as the slash bass
+                slash_at = i
+                
+        #every chord was padded/cut to 8 notes when its DOT closed
+        midi = np.frombuffer(b''.join(chord_rows), dtype=np.uint8).reshape(-1, 8).astype(np.int16)
+        return VoicingOutput(midi, np.array(chord_durations, dtype=np.float64), chord_labels), status
     
     
     #--------------------------------------------------------------------------------
@@ -891,38 +1134,15 @@ class Voicing:
         if not prev_notes or not next_notes:
             return 0
         
-        total_distance = 0
-        
-        # For each note in the new chord, find its closest corresponding note in previous chord
-        # This creates optimal voice leading
-        used_prev_indices = set()
+        # Each note in the new chord is paired with its own note in the previous chord so that
+        # the total movement is minimal. Distances consider octave equivalence: the next
+        # note is also tried an octave below and above
+        total_distance = _voice_leading_distance(np.array(prev_notes, dtype=np.int64),
+                                                 np.array(next_notes, dtype=np.int64))
+        if total_distance < 0:
+            return float('inf')
         
-        for next_note in next_notes:
-            min_distance = float('inf')
-            best_prev_idx = 0
-            
-            # Try matching to each unused previous note
-            for prev_idx, prev_note in enumerate(prev_notes):
-                if prev_idx in used_prev_indices:
-                    continue
-                    
-                # Calculate distance (considering octave equivalence)
-                distance = abs(next_note - prev_note)
-                
-                # Also try octave transpositions to find closest version
-                for octave_shift in [-12, 12]:
-                    alt_distance = abs((next_note + octave_shift) - prev_note)
-                    if alt_distance < distance:
-                        distance = alt_distance
-                
-                if distance < min_distance:
-                    min_distance = distance
-                    best_prev_idx = prev_idx
-            
-            used_prev_indices.add(best_prev_idx)
-            total_distance += min_distance
-        
-        return total_distance
+        return int(total_distance)
     
     def select_best_voicing(self, previous_voicing, candidate_voicings, prev_root=None, curr_root=None):
         """
@@ -944,32 +1164,27 @@ class Voicing:
         if not prev_notes:
             return candidate_voicings[0]
         
-        best_voicing = None
-        min_distance = float('inf')
-        
+        #pack the candidates the way _candidate_table does, empty voicings get length 0
+        lengths = np.array([len(v) for v in candidate_voicings], dtype=np.int64)
+        rows = np.zeros((len(candidate_voicings), max(8, lengths.max())), dtype=np.int64)
+        for k, voicing in enumerate(candidate_voicings):
+            rows[k, :lengths[k]] = voicing
+        means = rows.sum(axis=1) / np.maximum(lengths, 1)
+        return candidate_voicings[self._best_candidate(prev_notes, rows, lengths, means)]
+    
+    def _best_candidate(self, prev_notes, rows, lengths, means):
+        #index of the candidate row with the lowest voice leading distance + drift penalty from
+        #the (non-zero) previous notes; the first row when none of them can be matched
         # Calculate center of previous voicing to bias towards keeping register
-        prev_avg = sum(prev_notes) / len(prev_notes) if prev_notes else 60
+        prev_avg = sum(prev_notes) / len(prev_notes)
+        sorted_prev = np.sort(np.array(prev_notes, dtype=np.int64))
         
-        for voicing in candidate_voicings:
-            # Filter out empty voicings
-            if not voicing: continue
-            
-            # Calculate total voice movement distance
-            # calculate_optimized_distance does a good job matching voice-to-voice
-            distance = self.calculate_optimized_distance(prev_notes, voicing)
-            
-            # Add a small penalty for extreme register shifts (drift)
-            # This helps keep the progression centered if movement is equal
-            curr_avg = sum(voicing) / len(voicing)
-            drift_penalty = abs(curr_avg - prev_avg) * 0.1
-            
-            total_score = distance + drift_penalty
-            
-            if total_score < min_distance:
-                min_distance = total_score
-                best_voicing = voicing
+        # Add a small penalty for extreme register shifts (drift)
+        # This helps keep the progression centered if movement is equal
+        drift_penalty = np.abs(means - prev_avg) * 0.1
         
-        return best_voicing if best_voicing is not None else candidate_voicings[0]
+        # Total voice movement distance (calculate_optimized_distance) + drift of every row
+        return int(_best_row(sorted_prev, rows, lengths, drift_penalty))
     
     def optimize_voicing_octaves(self, prev_notes, next_voicing):
         """
@@ -998,50 +1213,17 @@ class Voicing:
         # Get previous upper voices (exclude bass)
         prev_upper = sorted([n for n in prev_notes if n > prev_notes[0]])
         
-        optimized = [root]  # Bass is locked
-        
-        # For each upper voice, find closest octave to previous upper voices
-        for next_note in upper_voices:
-            best_note = next_note
-            min_distance = float('inf')
-            
-            # Try different octaves
-            for octave_shift in [-24, -12, 0, 12, 24]:  # ±2 octaves
-                candidate = next_note + octave_shift
-                
-                # Must be: in range, above root, in comfortable voicing range
-                if candidate <= root or candidate < 24 or candidate > 96:
-                    continue
-                
-                # For 3rd and 7th (typically first two upper voices), prefer range C3-C5
-                # This follows Berklee recommendation for basic chord sound placement
-                voice_idx = len(optimized) - 1
-                if voice_idx <= 2:  # First two upper voices (likely 3 and 7)
-                    if candidate < 48 or candidate > 72:  # Outside C3-C5
-                        continue
-                
-                # Find distance to closest previous upper voice
-                if prev_upper:
-                    closest_prev_distance = min(abs(candidate - p) for p in prev_upper)
-                else:
-                    closest_prev_distance = abs(candidate - root)
-                
-                if closest_prev_distance < min_distance:
-                    min_distance = closest_prev_distance
-                    best_note = candidate
-            
-            optimized.append(best_note)
-        
-        # Sort upper voices only (keep root first)
-        if len(optimized) > 1:
-            upper_sorted = sorted(optimized[1:])
-            optimized = [optimized[0]] + upper_sorted
+        # For each upper voice, find closest octave to previous upper voices (±2 octaves)
+        upper = _fit_octaves(root, np.array(upper_voices, dtype=np.int64),
+                             np.array(prev_upper, dtype=np.int64))
         
-        # Pad with zeros
-        while len(optimized) < len(next_voicing):
-            optimized.append(0)
+        # Sort upper voices only (keep root first), the bass is locked; the remaining slots
+        # of the zero buffer are the padding
+        optimized = np.zeros(len(next_voicing), dtype=np.int64)
+        optimized[0] = root
+        optimized[1:upper.shape[0] + 1] = np.sort(upper)
         
-        return optimized
+        return optimized.tolist()
     
     def check_and_add_ninth(self, prev_notes, current_notes, root_note):
         """
@@ -1069,6 +1251,12 @@ class Voicing:
         if gap <= 5:
             return current_notes  # No gap to fill
         
+        # Bit p + 2 is set when pitch p lies within a whole step of an existing note
+        # (offset by 2 so the lowest neighbour never needs a negative shift)
+        near_mask = 0
+        for n in current_notes:
+            near_mask |= 0b11111 << n
+        
         # Try natural 9th first, then b9 only if natural doesn't work
         ninth_options = [2, 1]
         
@@ -1084,13 +1272,11 @@ class Voicing:
             if ninth_note > 96:
                 continue
                 
-            too_close = any(abs(ninth_note - n) <= 2 for n in current_notes)
-            if too_close:
+            if near_mask >> (ninth_note + 2) & 1:
                 continue
             
-            # Found a 9th that fills the gap - use it and stop
-            current_notes.append(ninth_note)
-            current_notes.sort()
+            # Found a 9th that fills the gap - use it and stop (the notes are already sorted)
+            insort(current_notes, ninth_note)
             break
         
         return current_notes
@@ -1098,7 +1284,8 @@ class Voicing:
     def calculate_optimized_distance(self, prev_notes, next_notes):
         """
         Calculate total voice leading distance between two voicings.
-        Each voice finds its nearest corresponding voice in the next chord.
+        Each voice is matched to its own voice in the next chord so that the total
+        movement is minimal (minimum-cost bipartite matching).
         
         Args:
             prev_notes: Previous chord notes (non-zero only)
@@ -1107,36 +1294,26 @@ class Voicing:
         Returns:
             Total distance (sum of minimum movements)
         """
-        next_clean = [n for n in next_notes if n != 0]
-        
-        if not prev_notes or not next_clean:
+        if not prev_notes:
+            return 0
+        return self._sorted_prev_distance(np.sort(np.array(prev_notes, dtype=np.int64)), next_notes)
+    
+    def _sorted_prev_distance(self, sorted_prev, next_notes):
+        #calculate_optimized_distance with the previous notes already as a sorted array, so
+        #select_best_voicing converts them once for all its candidates
+        next_clean = np.asarray(next_notes)
+        next_clean = next_clean[next_clean != 0]
+        if next_clean.shape[0] == 0:
             return 0
         
-        # Greedy matching: each next note to its closest unused previous note
-        used_prev = set()
-        total_distance = 0
-        
-        # Sort both by pitch for better matching
-        sorted_next = sorted(next_clean)
-        sorted_prev = sorted(prev_notes)
+        # Optimal matching: each next note to its own previous note, least total movement
+        # (pitch-sorted, so ties resolve the same way every time)
+        sorted_next = np.sort(next_clean.astype(np.int64))
+        total_distance = _optimized_distance(sorted_prev, sorted_next)
+        if total_distance < 0:
+            return float('inf')
         
-        for next_note in sorted_next:
-            min_dist = float('inf')
-            best_prev_idx = 0
-            
-            for i, prev_note in enumerate(sorted_prev):
-                if i in used_prev:
-                    continue
-                    
-                dist = abs(next_note - prev_note)
-                if dist < min_dist:
-                    min_dist = dist
-                    best_prev_idx = i
-            
-            used_prev.add(best_prev_idx)
-            total_distance += min_dist
-        
-        return total_distance
+        return int(total_distance)
     
     def select_voicing_by_position(self, position):
         """
@@ -1176,30 +1353,18 @@ class Voicing:
         if not current_notes or not next_notes:
             return next_voicing
         
-        # Optimize each voice to stay close to previous chord
-        optimized = []
-        for next_note in next_notes:
-            # Find closest version of this note to any note in current chord
-            best_note = next_note
-            min_distance = float('inf')
-            
-            for current_note in current_notes:
-                # Try this note and its octave transpositions
-                for octave_shift in [-12, 0, 12]:
-                    candidate = next_note + octave_shift
-                    distance = abs(candidate - current_note)
-                    
-                    if distance < min_distance:
-                        min_distance = distance
-                        best_note = candidate
-            
-            optimized.append(best_note)
+        # Optimize each voice to stay close to previous chord: every next note an octave
+        # down, in place and up against every current note, shape (next, current, shift)
+        cands = np.array(next_notes, dtype=np.int64)[:, None] + np.array([-12, 0, 12])
+        dists = np.abs(cands[:, None, :] - np.array(current_notes, dtype=np.int64)[None, :, None])
+        # Closest version of each note (the first current note and shift on ties)
+        best = dists.reshape(len(next_notes), -1).argmin(axis=1) % 3
         
-        # Pad with zeros to match original length
-        while len(optimized) < len(next_voicing):
-            optimized.append(0)
+        # Zero buffer of the original length, the unused slots are the padding
+        optimized = np.zeros(len(next_voicing), dtype=np.int64)
+        optimized[:len(next_notes)] = cands[np.arange(len(next_notes)), best]
             
-        return optimized
+        return optimized.tolist()
     
     def add_extensions_for_quality(self, voicing, chord_type, root):
         """
@@ -1216,26 +1381,11 @@ class Voicing:
         """
         extended = voicing.copy()
         
-        # Add 9th for certain chord types (common in jazz)
-        if chord_type in ['maj7', 'm7', 'dom7', 'sus7', 'm_maj7']:
-            # Add 9th (14 semitones from root) in upper register if not too crowded
-            if len(extended) < 6:
-                ninth = 14  # 9th interval
-                if ninth not in extended:
-                    extended.append(ninth)
-        
-        # Add 11th for sus chords
-        if chord_type in ['sus7', 'sus4']:
-            if len(extended) < 6:
-                eleventh = 17  # 11th interval  
-                if eleventh not in extended:
-                    extended.append(eleventh)
-        
-        # Add 13th for dominant and major chords
-        if chord_type in ['dom7', 'maj7'] and len(extended) < 7:
-            thirteenth = 21  # 13th interval
-            if thirteenth not in extended:
-                extended.append(thirteenth)
+        # 9th for the jazz qualities, 11th for sus chords, 13th for dominant and major chords,
+        # each only while the voicing is not too crowded
+        for interval, gate in QUALITY_EXTENSIONS.get(chord_type, ()):
+            if len(extended) < gate and interval not in extended:
+                extended.append(interval)
         
         return extended
     
@@ -1296,42 +1446,40 @@ class Voicing:
         Just export all of them in order.
         """
         # Create a MIDI file
-        track    = 0
         channel  = 0
         tempo    = 120   # In BPM
+        ticks    = 960   # Ticks per beat
 
-        MyMIDI = MIDIFile()
-        MyMIDI.addTempo(track, 0, tempo)
-
-        time = 0  # Start time in beats
-        
-        for item in sequence:
-            midi_notes = item[0]
-            duration = float(item[1])
-            
-            # Get non-zero notes
-            notes = [n for n in midi_notes if n > 0]
-            
-            # Skip if no notes
-            if len(notes) == 0:
-                continue
-            
-            # Convert duration from seconds to beats
-            # At 120 BPM: 1 second = 2 beats
-            duration_in_beats = duration * (tempo / 60.0)
-            
-            for pitch in notes:
-                volume = int(random.uniform(55, 85))
-                MyMIDI.addNote(track, channel, pitch, time, duration_in_beats, volume)
-            
-            time += duration_in_beats
+        # Build the whole note schedule first (see chord_note_schedule)
+        pitches, start_beats, duration_beats = chord_note_schedule(sequence, tempo)
+        
+        # One draw for every note instead of a random.uniform call per note
+        volumes = np.random.uniform(55, 85, size=len(pitches)).astype(np.int64)
+        
+        # Note on/off events as parallel arrays, in ticks, ordered by time with the note offs
+        # first on a shared tick (a chord ends exactly where the next one starts)
+        on_tick = np.rint(start_beats * ticks).astype(np.int64)
+        off_tick = np.rint((start_beats + duration_beats) * ticks).astype(np.int64)
+        event_tick = np.concatenate((off_tick, on_tick))
+        event_on = np.concatenate((np.zeros_like(off_tick), np.ones_like(on_tick)))
+        event_pitch = np.concatenate((pitches, pitches))
+        event_volume = np.concatenate((volumes, volumes))
+        order = np.lexsort((event_pitch, event_on, event_tick))
+        event_delta = np.diff(event_tick[order], prepend=0)
+        
+        # Tempo track + one note track, written in a single pass
+        mid = MidiFile(type=1, ticks_per_beat=ticks)
+        mid.tracks.append(MidiTrack([MetaMessage('set_tempo', tempo=mido.bpm2tempo(tempo), time=0)]))
+        mid.tracks.append(MidiTrack(
+            Message('note_on' if on else 'note_off', note=pitch, velocity=volume, channel=channel, time=delta)
+            for on, pitch, volume, delta in zip(event_on[order].tolist(), event_pitch[order].tolist(),
+                                               event_volume[order].tolist(), event_delta.tolist())))
   
         fullname = path + filename + '.mid'
+        mid.save(fullname)
         
-        with open(fullname, "wb") as output_file:
-            MyMIDI.writeFile(output_file)
-        
-        print('✓ MIDI file created:', filename + '.mid') 
+        if self.verbose:
+            print('✓ MIDI file created:', filename + '.mid') 
         return fullname
         
         
@@ -1348,46 +1496,43 @@ class Voicing:
             print(f"Error: File not found - {filename}")
             return
 
-         # Load the MIDI file into a music21 stream
-        mf = midi.MidiFile()
-        mf.open(filename)
-        mf.read()
-        mf.close()
-
-        # Convert MIDI file to a music21 stream
-        s = midi.translate.midiFileToStream(mf)
-
-        # Play the MIDI stream
-        s.show('midi')
+        # Render with play_mpe's synth and hand the audio to the OS player, no music21 stream
+        # built only to be written back to MIDI (imported here: only needed for playback)
+        from play_mpe import render_mpe_to_audio_data, play_audio_data
+        
+        audio_data, sample_rate = render_mpe_to_audio_data(filename, speed=1.0)
+        play_audio_data(audio_data, sample_rate)
         
     #--------------------------------------------------------------------------------
     #Convert the separated chords into one unify chord
     def convertChordsFromOutput(self, sequence):
         chord = []
         chordArray = []
-        ignore = self.listToIgnore()
-        ignore.remove('.') #we need the dot to identify the chord
-        ignore.remove('|')
-        ignore.remove(':|')
-        ignore.remove('<end>')
+        #the dot (and the other closers) are kept: we need them to identify the chord
+        skip = self._convert_skip
+        terminators = self._convert_terminators
+        spaced = self._convert_spaced
         #if sequence[len(sequence)-1] != '.':
         #    sequence.append('.')
         for i in range (4, len(sequence)): #first four elements are style context
             element = sequence[i]
            
-            if element not in ignore and element not in self.durations:
+            if element not in skip:
                 if element == 'dom7':
                     element = '7'
                 #check if the chord starts
-                if element != '.' and element != '|' and element != ':|' and element != '<end>':
+                if element not in terminators:
                     #print(i, duration)
                     #collect the elements of the chord
-                    if element.find('add') >= 0 or element.find('subtract') >= 0 or element.find('alter') >= 0:
+                    needs_space = spaced.get(element)
+                    if needs_space is None:
+                        needs_space = spaced[element] = _is_spaced_extension(element)
+                    if needs_space:
                         chord.append(' ')
                     chord.append(element)
                     #print(i, chord)
                 if len(chord) > 0:
-                    if  element == '.' or element == '|' or element == ':|' or element == '<end>':
+                    if element in terminators:
                         #print(i, element)listToIgnore
                         #join the sections into a formatted chord
                         c = ''.join(chord) 
@@ -1403,7 +1548,17 @@ class Voicing:
         return Message('pitchwheel', pitch=pitch, channel=channel)
     
     #----------------------------------------------------
-    def MidiChord(self, path = "../dataset/midi_files/", filename = 'detuned_Cmaj_chord'):
+    def join(self):
+        #wait until every MIDI file still in flight on the background writer is on disk,
+        #re-raising the first write error
+        pending, self._pending_saves = self._pending_saves, []
+        for future in pending:
+            future.result()
+    
+    #----------------------------------------------------
+    def _midi_chord_file(self):
+        #the detuned Cmaj7 chord written by MidiChord; its content never changes, so one
+        #MidiFile is built and then only read by every save
         
         # Create a new MIDI file and a new track
         mid = MidiFile()
@@ -1430,50 +1585,58 @@ class Voicing:
         # Time for the start of the chord
         start_time = 0
 
-        # Add the C note to the MIDI file (no detuning)
-        track.append(Message('note_on', note=C_note, velocity=volume, channel=C_channel, time=start_time))
-
-        # Add the detuned E note
-        track.append(self.create_pitch_bend(-25, E_channel))  # -25 cents detune
-        track.append(Message('note_on', note=E_note, velocity=volume, channel=E_channel, time=start_time))
-
-        # Add the G note to the MIDI file (no detuning)
-        track.append(Message('note_on', note=G_note, velocity=volume, channel=G_channel, time=start_time))
-
-        # Add the detuned B note
-        track.append(self.create_pitch_bend(-28, B_channel))  # -28 cents detune
-        track.append(Message('note_on', note=B_note, velocity=volume, channel=B_channel, time=start_time))
-
-        # Add note off messages for all notes at the same time (duration ticks later)
-        track.append(Message('note_off', note=C_note, velocity=volume, channel=C_channel, time=duration))
-        track.append(Message('note_off', note=E_note, velocity=volume, channel=E_channel, time=0))  # time=0 because it’s the same moment
-        track.append(Message('note_off', note=G_note, velocity=volume, channel=G_channel, time=0))
-        track.append(Message('note_off', note=B_note, velocity=volume, channel=B_channel, time=0))
-        track.append(self.create_pitch_bend(0, E_channel))  # Reset pitch bend for E
-        track.append(self.create_pitch_bend(0, B_channel))  # Reset pitch bend for B
+        # The whole chord as one message list, spliced into the track at once
+        track.extend([
+            # Add the C note to the MIDI file (no detuning)
+            Message('note_on', note=C_note, velocity=volume, channel=C_channel, time=start_time),
+            # Add the detuned E note
+            self.create_pitch_bend(-25, E_channel),  # -25 cents detune
+            Message('note_on', note=E_note, velocity=volume, channel=E_channel, time=start_time),
+            # Add the G note to the MIDI file (no detuning)
+            Message('note_on', note=G_note, velocity=volume, channel=G_channel, time=start_time),
+            # Add the detuned B note
+            self.create_pitch_bend(-28, B_channel),  # -28 cents detune
+            Message('note_on', note=B_note, velocity=volume, channel=B_channel, time=start_time),
+            # Add note off messages for all notes at the same time (duration ticks later)
+            Message('note_off', note=C_note, velocity=volume, channel=C_channel, time=duration),
+            Message('note_off', note=E_note, velocity=volume, channel=E_channel, time=0),  # time=0 because it’s the same moment
+            Message('note_off', note=G_note, velocity=volume, channel=G_channel, time=0),
+            Message('note_off', note=B_note, velocity=volume, channel=B_channel, time=0),
+            self._zero_pb[E_channel],  # Reset pitch bend for E
+            self._zero_pb[B_channel],  # Reset pitch bend for B
+        ])
+        
+        return mid
+    
+    def MidiChord(self, path = "../dataset/midi_files/", filename = 'detuned_Cmaj_chord'):
+        
+        # Same chord every call: build the MIDI file once and reuse it
+        if self._chord_mid is None:
+            self._chord_mid = self._midi_chord_file()
+        mid = self._chord_mid
 
-        tz = pytz.timezone('Europe/Stockholm')
-        stockholm_now = datetime.now(tz)
-        mh = str(stockholm_now.hour)
-        mm = str(stockholm_now.minute)
-        ms = str(stockholm_now.second)
-        
-        if len(mh) == 1:
-            mh = '0' + str(stockholm_now.hour)
-        if len(mm) == 1:
-            mm= '0' + str(stockholm_now.minute)
-        if len(ms) == 1:
-            ms = '0' + str(stockholm_now.second)
-            
-        ext =  mh + mm + ms + '_' +str(stockholm_now.day) + '_' + str(stockholm_now.month) + '_' + str(stockholm_now.year) + '_'
+        year, month, day, hour, minute, second = datetime.now(STOCKHOLM_TZ).timetuple()[:6]
+        ext = f"{hour:02d}{minute:02d}{second:02d}_{day}_{month}_{year}_"
         
-        fullname = path + ext + filename + '.mid'
-        currentName = ext + filename + '.mid'
+        currentName = f"{ext}{filename}.mid"
+        fullname = os.path.join(path, currentName)
         
-        # Save the MIDI file
-        mid.save(fullname)
-            
-        print("MIDI file generated: ", currentName)
+        # Earlier writes that are done are dropped (their failures were already reported)
+        self._pending_saves = [f for f in self._pending_saves if not f.done()]
+        
+        # Save the MIDI file in the background (mid is not touched after this), see join()
+        future = _IO_POOL.submit(mid.save, fullname)
+        future.add_done_callback(lambda f: self._report_save(f, currentName))
+        self._pending_saves.append(future)
+    
+    def _report_save(self, future, currentName):
+        #done-callback of a MidiChord write: failures are always reported, so they are not
+        #lost when nobody collects the future
+        error = future.exception()
+        if error is not None:
+            print(f"MIDI file not written: {currentName} ({error!r})", file=sys.stderr)
+        elif self.verbose:
+            print("MIDI file generated: ", currentName)
 
 
     